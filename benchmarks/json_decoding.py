@@ -0,0 +1,86 @@
+'''
+Time response decoding with the stdlib json module and with orjson (when installed).
+
+Payloads are shaped after pull and graphqlbatch responses. Pass --pull and/or --graphql
+with paths to recorded response bodies to use real captures instead.
+
+    python benchmarks/json_decoding.py [--pull FILE] [--graphql FILE] [--number 200]
+'''
+
+import argparse
+import json
+import random
+import timeit
+
+from flat import http, utils
+
+#==================================================================================================================================================
+
+def fake_delta(i):
+    return {
+        "type": "delta",
+        "delta": {
+            "class": "NewMessage",
+            "attachments": [],
+            "body": "message number {} ".format(i) * random.randint(1, 8),
+            "data": {"prng": json.dumps([{"o": 0, "l": 5, "i": "1000{}".format(i), "t": "p"}])},
+            "irisSeqId": str(i),
+            "messageMetadata": {
+                "actorFbId": "1000{}".format(i % 50),
+                "messageId": "mid.$cAAA{:x}".format(i),
+                "offlineThreadingId": str(6400000000000000000 + i),
+                "tags": ["source:chat:web", "cg-enabled", "inbox"],
+                "threadKey": {"threadFbId": str(1500000000000 + i % 20)},
+                "timestamp": str(1530000000000 + i)
+            }
+        }
+    }
+
+def fake_pull(n):
+    body = {"t": "msg", "seq": n, "u": 100001, "ms": [fake_delta(i) for i in range(n)]}
+    return ("for (;;); " + json.dumps(body)).encode("utf-8")
+
+def fake_graphql(n):
+    lines = []
+    for i in range(n):
+        thread = {
+            "thread_key": {"thread_fbid": str(1500000000000 + i), "other_user_id": None},
+            "name": "group {}".format(i),
+            "thread_type": "GROUP",
+            "image": None,
+            "approval_mode": 0,
+            "customization_info": {"emoji": None, "outgoing_bubble_color": None, "participant_customizations": []},
+            "thread_admins": [{"id": "1000{}".format(j)} for j in range(3)],
+            "all_participants": {"nodes": [{"messaging_actor": {"id": "1000{}".format(j)}} for j in range(40)]}
+        }
+        lines.append(json.dumps({"q{}".format(i): {"data": {"message_thread": thread}}}))
+    lines.append(json.dumps({"successful_results": n, "error_results": 0, "skipped_results": 0}))
+    return "\r\n".join(lines).encode("utf-8")
+
+def run(name, func, payload, number):
+    t = timeit.timeit(lambda: func(payload), number=number)
+    print("  {:<20} {:>8.1f} us/call".format(name, t / number * 1e6))
+
+def main(args):
+    pull = open(args.pull, "rb").read() if args.pull else fake_pull(200)
+    graphql = open(args.graphql, "rb").read() if args.graphql else fake_graphql(50)
+
+    backends = [("stdlib", json.loads, json.dumps)]
+    if utils.orjson is not None:
+        backends.append(("orjson", None, None))
+    else:
+        print("orjson is not installed, only timing the stdlib backend.")
+
+    for name, loads, dumps in backends:
+        utils.set_json_backend(loads, dumps)
+        print(name)
+        run("load_broken_json", http.load_broken_json, pull, args.number)
+        run("load_concat_json", http.load_concat_json, graphql, args.number)
+    utils.set_json_backend()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pull")
+    parser.add_argument("--graphql")
+    parser.add_argument("--number", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+'''
+Measure bytes per object for a cache of users and groups built from the model classes.
+
+For comparison, the same cache is also built with plain kwargs/setattr classes,
+which is how the models used to store their fields.
+
+    python benchmarks/model_memory.py [--users 100000] [--groups 10000] [--members 20]
+'''
+
+import argparse
+import gc
+import random
+import tracemalloc
+
+from flat import enums, thread, user
+
+#==================================================================================================================================================
+
+class _DictObject:
+    def __init__(self, id, **kwargs):
+        self._id = id
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @property
+    def id(self):
+        return self._id
+
+class _DictParticipant:
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+class _State:
+    client_user = None
+
+def build_slotted(state, n_users, n_groups, members):
+    users = {}
+    for i in range(n_users):
+        uid = str(100000 + i)
+        users[uid] = user.User(
+            uid, _state=state, full_name="User {}".format(i), first_name="User", gender=enums.Gender.UNKNOWN,
+            alias=None, thumbnail="https://example.com/{}.jpg".format(i), url="https://facebook.com/{}".format(uid), is_friend=False
+        )
+    ids = list(users)
+    groups = {}
+    for i in range(n_groups):
+        gid = str(900000 + i)
+        g = thread.Group(gid, _state=state, name="Group {}".format(i), image_url=None, emoji=None, color=None, approval_mode=0)
+        for uid in random.sample(ids, members):
+            g.store_participant(users[uid], admin=False, nickname=None)
+        groups[gid] = g
+    return users, groups
+
+def build_dict(state, n_users, n_groups, members):
+    users = {}
+    for i in range(n_users):
+        uid = str(100000 + i)
+        users[uid] = _DictObject(
+            uid, _state=state, full_name="User {}".format(i), first_name="User", gender=enums.Gender.UNKNOWN,
+            alias=None, thumbnail="https://example.com/{}.jpg".format(i), url="https://facebook.com/{}".format(uid), is_friend=False
+        )
+    ids = list(users)
+    groups = {}
+    for i in range(n_groups):
+        gid = str(900000 + i)
+        g = _DictObject(gid, _state=state, name="Group {}".format(i), image_url=None, emoji=None, color=None, approval_mode=0, _participants={})
+        for uid in random.sample(ids, members):
+            g._participants[uid] = _DictParticipant(_state=state, user=users[uid], thread=g, admin=False, nickname=None)
+        groups[gid] = g
+    return users, groups
+
+def measure(build, args):
+    random.seed(0)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = build(_State(), args.users, args.groups, args.members)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    objects = args.users + args.groups * (args.members + 1)
+    return after - before, objects, cache
+
+def main(args):
+    for name, build in (("kwargs/setattr", build_dict), ("__slots__", build_slotted)):
+        total, objects, cache = measure(build, args)
+        print("{:<16} {:>8.1f} MiB total   {:>6.1f} bytes/object".format(name, total / 2**20, total / objects))
+        del cache
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--groups", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,134 @@
+'''
+Compare the old ping-then-pull loop against the pipelined pull engine of Client.
+
+A local aiohttp server stands in for the edge-chat host. Every request costs
+a simulated round trip, and pulls are held until messages are available.
+
+    python benchmarks/pull_pipeline.py [--rtt 0.05] [--rate 200] [--duration 10]
+'''
+
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+import flat
+from flat import http
+
+#==================================================================================================================================================
+
+class StandInServer:
+    def __init__(self, *, rtt, rate, hold):
+        self.rtt = rtt
+        self.rate = rate
+        self.hold = hold
+        self.seq = 0
+        self.pending = []
+        self.new_data = asyncio.Event()
+
+    async def produce(self):
+        interval = 1 / self.rate
+        while True:
+            await asyncio.sleep(interval)
+            self.seq += 1
+            self.pending.append({"type": "bench", "seq": self.seq, "sent": time.perf_counter()})
+            self.new_data.set()
+
+    async def ping(self, request):
+        await asyncio.sleep(self.rtt)
+        return web.Response(text="for (;;); {\"t\":\"pong\"}")
+
+    async def pull(self, request):
+        await asyncio.sleep(self.rtt / 2)
+        if not self.pending:
+            self.new_data.clear()
+            try:
+                await asyncio.wait_for(self.new_data.wait(), self.hold)
+            except asyncio.TimeoutError:
+                pass
+        ms, self.pending = self.pending, []
+        body = {"t": "msg", "seq": self.seq, "ms": ms}
+        await asyncio.sleep(self.rtt / 2)
+        return web.Response(text="for (;;); " + json.dumps(body))
+
+class Recorder:
+    def __init__(self):
+        self.count = 0
+        self.latencies = []
+
+    async def process_raw_data(self, raw):
+        now = time.perf_counter()
+        for m in raw.get("ms", []):
+            self.count += 1
+            self.latencies.append(now - m["sent"])
+
+def make_http(port):
+    class LocalHTTPRequest(http.HTTPRequest):
+        STICKY = "http://127.0.0.1:{}/{{}}/pull".format(port)
+        PING = "http://127.0.0.1:{}/{{}}/active_ping".format(port)
+
+    h = LocalHTTPRequest()
+    h.user_channel = "p_0"
+    h.client_id = "0"
+    h.user_id = "0"
+    h.sticky = "0"
+    h.pool = "0"
+    return h
+
+async def sequential(h, recorder, duration):
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        await h.ping()
+        raw = await h.pull()
+        await recorder.process_raw_data(raw)
+
+async def pipelined(h, recorder, duration):
+    client = flat.Client()
+    client._http = h
+    client._state = recorder
+    task = asyncio.ensure_future(client._pull_loop())
+    await asyncio.sleep(duration)
+    client._closed.set()
+    task.cancel()
+
+def report(name, recorder, duration):
+    lat = sorted(recorder.latencies) or [0]
+    print("{:<12} {:>10.1f} msg/s   p50 {:>7.1f} ms   p99 {:>7.1f} ms".format(
+        name,
+        recorder.count / duration,
+        lat[len(lat)//2] * 1000,
+        lat[int(len(lat)*0.99)] * 1000
+    ))
+
+async def main(args):
+    for name, runner in (("sequential", sequential), ("pipelined", pipelined)):
+        server = StandInServer(rtt=args.rtt, rate=args.rate, hold=args.hold)
+        app = web.Application()
+        app.router.add_get("/{channel}/pull", server.pull)
+        app.router.add_get("/{channel}/active_ping", server.ping)
+        runner_ = web.AppRunner(app)
+        await runner_.setup()
+        site = web.TCPSite(runner_, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        h = make_http(port)
+        recorder = Recorder()
+        producer = asyncio.ensure_future(server.produce())
+        try:
+            await runner(h, recorder, args.duration)
+        finally:
+            producer.cancel()
+            await h.close()
+            await runner_.cleanup()
+        report(name, recorder, args.duration)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt", type=float, default=0.05)
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--hold", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+'''
+Measure peak RSS while uploading files of increasing size, streamed from disk versus read into memory first.
+
+A local aiohttp server stands in for the upload host and discards what it receives.
+Every upload runs in a fresh subprocess, so each peak RSS figure belongs to that upload alone.
+
+    python benchmarks/upload_memory.py [--sizes 16,64,256] [--concurrency 1]
+'''
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from aiohttp import web
+
+from flat import content, http
+
+#==================================================================================================================================================
+
+async def upload(request):
+    reader = await request.multipart()
+    async for part in reader:
+        while await part.read_chunk():
+            pass
+    return web.Response(text="for (;;); {\"payload\":{\"metadata\":[{\"file_id\":\"1\"}]}}")
+
+def make_http(port):
+    class LocalHTTPRequest(http.HTTPRequest):
+        UPLOAD = "http://127.0.0.1:{}/upload".format(port)
+
+    return LocalHTTPRequest()
+
+async def run_one(path, mode, concurrency):
+    app = web.Application(client_max_size=0)
+    app.router.add_post("/upload", upload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    h = make_http(port)
+    try:
+        if mode == "stream":
+            files = [content.File(path) for i in range(concurrency)]
+        else:
+            with open(path, "rb") as fp:
+                data = fp.read()
+            files = [content.File(data, os.path.basename(path)) for i in range(concurrency)]
+        await asyncio.gather(*(h.upload_file(f) for f in files))
+    finally:
+        await h.close()
+        await runner.cleanup()
+
+def peak_rss_mib():
+    #ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+def child(args):
+    asyncio.get_event_loop().run_until_complete(run_one(args.path, args.mode, args.concurrency))
+    print(peak_rss_mib())
+
+def main(args):
+    print("{:>8} {:>14} {:>14}".format("MiB", "stream RSS", "memory RSS"))
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as fp:
+            chunk = os.urandom(2**20)
+            for i in range(size):
+                fp.write(chunk)
+        try:
+            peaks = []
+            for mode in ("stream", "memory"):
+                out = subprocess.check_output([
+                    sys.executable, __file__, "--child", "--mode", mode, "--path", fp.name, "--concurrency", str(args.concurrency)
+                ])
+                peaks.append(float(out))
+            print("{:>8} {:>10.1f} MiB {:>10.1f} MiB".format(size, *peaks))
+        finally:
+            os.remove(fp.name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="16,64,256")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--child", action="store_true")
+    parser.add_argument("--mode")
+    parser.add_argument("--path")
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        main(args)
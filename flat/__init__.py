@@ -1,7 +1,9 @@
 from .base import *
 from .client import *
 from .content import *
+from .enums import *
 from .error import *
+from .retry import *
 from .thread import *
 from .message import *
 from .user import *
@@ -1,5 +1,7 @@
 from . import base, utils
 import asyncio
+import os
+from io import BytesIO
 from yarl import URL
 
 #==================================================================================================================================================
@@ -11,12 +13,37 @@ def _may_has_extension(filename):
         ext, hyph, name = filename.partition("-")
         return name + "." + ext
 
+def _read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_file(path, data):
+    #write then rename, so a concurrent reader never sees a half-written file
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _open_for_save(path, resume):
+    offset = os.path.getsize(path) if resume and os.path.exists(path) else 0
+    return open(path, "ab" if offset else "wb"), offset
+
 #==================================================================================================================================================
 
 class _BaseAttachment(base.Object):
-    pass
+    __slots__ = ()
 
 class FileAttachment(_BaseAttachment):
+    __slots__ = ("filename", "url")
+
+    def __init__(self, id, *, _state, filename, url=None):
+        super().__init__(id, _state=_state)
+        self.filename = filename
+        self.url = url
+
     @classmethod
     def _extract_data(cls, node):
         return {"url": node.get("url")}
@@ -27,7 +54,57 @@ class FileAttachment(_BaseAttachment):
         filename = _may_has_extension(node["filename"])
         return cls(aid, _state=state, filename=filename, **cls._extract_data(node))
 
+    async def get_url(self):
+        return self.url
+
+    async def iter_content(self, *, chunk_size=65536, offset=0):
+        '''
+        Async iterator over the file content in chunks, starting from byte offset.
+        '''
+        url = await self.get_url()
+        async for chunk in self._state.http.stream(url, chunk_size=chunk_size, offset=offset):
+            yield chunk
+
+    async def save(self, fp=None, *, chunk_size=65536, resume=False):
+        '''
+        Download the file into fp, which can be a path or a binary file object, and return the number of bytes written.
+        With resume=True, an existing file is continued from its current size (or a file object from its position) with a Range request.
+        If fp is None, the content is returned as bytes instead.
+        '''
+        if fp is None:
+            return b"".join([chunk async for chunk in self.iter_content(chunk_size=chunk_size)])
+
+        if isinstance(fp, str):
+            #disk io goes to the executor so a slow disk doesn't stall the event loop
+            loop = self._state.loop
+            f, offset = await loop.run_in_executor(None, _open_for_save, fp, resume)
+            try:
+                return await self._write_to(f, offset, chunk_size, loop=loop)
+            finally:
+                await loop.run_in_executor(None, f.close)
+        else:
+            offset = fp.tell() if resume else 0
+            return await self._write_to(fp, offset, chunk_size)
+
+    async def _write_to(self, f, offset, chunk_size, *, loop=None):
+        written = 0
+        async for chunk in self.iter_content(chunk_size=chunk_size, offset=offset):
+            if loop is None:
+                f.write(chunk)
+            else:
+                await loop.run_in_executor(None, f.write, chunk)
+            written += len(chunk)
+        return written
+
 class ImageAttachment(FileAttachment):
+    __slots__ = ("animated", "height", "width")
+
+    def __init__(self, id, *, _state, filename, url=None, animated=False, height=None, width=None):
+        super().__init__(id, _state=_state, filename=filename, url=url)
+        self.animated = animated
+        self.height = height
+        self.width = width
+
     @classmethod
     def _extract_data(cls, node):
         xy = node["original_dimensions"]
@@ -45,15 +122,17 @@ class ImageAttachment(FileAttachment):
         }
 
     async def get_url(self):
-        if self.url is None:
+        if self.url is None or utils.url_expired(self.url):
             self.url = await self._state.http.fetch_image_url(self._id)
         return self.url
 
-    async def save(self):
-        url = await self.get_url()
-        return await self._state.http.get(url)
-
 class AudioAttachment(FileAttachment):
+    __slots__ = ("duration",)
+
+    def __init__(self, id, *, _state, filename, url=None, duration=None):
+        super().__init__(id, _state=_state, filename=filename, url=url)
+        self.duration = duration
+
     @classmethod
     def _extract_data(cls, node):
         return {
@@ -62,6 +141,14 @@ class AudioAttachment(FileAttachment):
         }
 
 class VideoAttachment(FileAttachment):
+    __slots__ = ("duration", "height", "width")
+
+    def __init__(self, id, *, _state, filename, url=None, duration=None, height=None, width=None):
+        super().__init__(id, _state=_state, filename=filename, url=url)
+        self.duration = duration
+        self.height = height
+        self.width = width
+
     @classmethod
     def _extract_data(cls, node):
         xy = node["original_dimensions"]
@@ -73,6 +160,19 @@ class VideoAttachment(FileAttachment):
         }
 
 class Sticker(_BaseAttachment):
+    __slots__ = ("label", "url", "width", "height", "column_count", "row_count", "frame_count", "frame_rate")
+
+    def __init__(self, id, *, _state, label, url, width, height, column_count, row_count, frame_count, frame_rate):
+        super().__init__(id, _state=_state)
+        self.label = label
+        self.url = url
+        self.width = width
+        self.height = height
+        self.column_count = column_count
+        self.row_count = row_count
+        self.frame_count = frame_count
+        self.frame_rate = frame_rate
+
     @classmethod
     def from_data(cls, state, node):
         sid = node["id"]
@@ -95,7 +195,46 @@ class Sticker(_BaseAttachment):
             row_count=row_count, frame_count=frame_count, frame_rate=frame_rate
         )
 
+    async def _fetch_sprite(self):
+        return await self._state.http.get(self.url)
+
+    async def read_sprite(self):
+        '''
+        The sprite sheet of this sticker as bytes.
+        '''
+        return await self._cached(self._state.sticker_sprites, "sprite", self._fetch_sprite)
+
+    async def _cached(self, cache, ext, produce):
+        data = cache.get(self._id)
+        if data is None:
+            data = await self._state._sticker_flight.do((self._id, ext), self._load_or_produce, cache, ext, produce)
+        return data
+
+    async def _load_or_produce(self, cache, ext, produce):
+        state = self._state
+        loop = state.loop
+        data = None
+        path = None
+        if state.sticker_cache_dir:
+            path = os.path.join(state.sticker_cache_dir, "{}.{}".format(self._id, ext))
+            data = await loop.run_in_executor(None, _read_file, path)
+        if data is None:
+            data = await produce()
+            if path:
+                await loop.run_in_executor(None, _write_file, path, data)
+        cache[self._id] = data
+        return data
+
 class EmbedLink(_BaseAttachment):
+    __slots__ = ("url", "title", "description", "media_url")
+
+    def __init__(self, id, *, _state, url, title, description, media_url):
+        super().__init__(id, _state=_state)
+        self.url = url
+        self.title = title
+        self.description = description
+        self.media_url = media_url
+
     @classmethod
     def from_data(cls, state, node):
         eid = node["legacy_attachment_id"]
@@ -126,41 +265,58 @@ try:
 except ImportError:
     pass
 else:
-    from io import BytesIO
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
 
-    async def _to_gif(self, fp, *, executor=None, loop=None):
-        bytes_ = await self._state.http.get(self.url)
-        im = BytesIO(bytes_)
-        frames = []
-        row_count = self.row_count
-        column_count = self.column_count
-        frame_count = self.frame_count
-        duration = self.frame_rate
-
-        def do_stuff():
-            image = Image.open(im)
-            img_width, img_height = image.size
-            width = img_width/column_count
-            height = img_height/row_count
+    def _slice_frames(image, row_count, column_count, frame_count):
+        width = image.width // column_count
+        height = image.height // row_count
+        if numpy is None or image.mode not in ("L", "P", "RGB", "RGBA"):
             frames = []
-            count = 0
-
-            for y_count in range(row_count):
-                y = y_count * height
-                for x_count in range(column_count):
-                    x = x_count * width
-                    raw = image.crop((x, y, x+width, y+height))
-                    frames.append(raw)
-                    count += 1
-                    if count == frame_count:
-                        break
-                else:
-                    continue
-                break
-
-            frames[0].save(fp, "gif", save_all=True, append_images=frames[1:], loop=0, duration=duration, transparency=255, disposal=2, optimize=False)
+            for i in range(frame_count):
+                y, x = divmod(i, column_count)
+                frames.append(image.crop((x*width, y*height, (x+1)*width, (y+1)*height)))
+            return frames
+
+        #cut the whole sheet into (frame, height, width[, channel]) tiles with one reshape instead of one crop per frame
+        arr = numpy.asarray(image)[:height*row_count, :width*column_count]
+        channels = arr.shape[2:]
+        tiles = arr.reshape(row_count, height, column_count, width, *channels).swapaxes(1, 2)
+        tiles = tiles.reshape(row_count*column_count, height, width, *channels)[:frame_count]
+        palette = image.getpalette() if image.mode == "P" else None
+        frames = []
+        for tile in tiles:
+            frame = Image.fromarray(numpy.ascontiguousarray(tile))
+            if palette:
+                frame.putpalette(palette)
+            frames.append(frame)
+        return frames
 
+    def _render_gif(sprite, row_count, column_count, frame_count, duration):
+        #module level and working on plain bytes, so it can run in a ProcessPoolExecutor
+        image = Image.open(BytesIO(sprite))
+        frames = _slice_frames(image, row_count, column_count, frame_count)
+        out = BytesIO()
+        frames[0].save(out, "gif", save_all=True, append_images=frames[1:], loop=0, duration=duration, transparency=255, disposal=2, optimize=False)
+        return out.getvalue()
+
+    async def _render(self, executor, loop):
+        sprite = await self._cached(self._state.sticker_sprites, "sprite", self._fetch_sprite)
         loop = loop or asyncio.get_event_loop()
-        await loop.run_in_executor(executor, do_stuff)
+        return await loop.run_in_executor(
+            executor or self._state.sticker_executor, _render_gif,
+            sprite, self.row_count, self.column_count, self.frame_count, self.frame_rate
+        )
+
+    async def _to_gif(self, fp, *, executor=None, loop=None):
+        gif = await self._cached(self._state.sticker_gifs, "gif", lambda: self._render(executor, loop))
+        if isinstance(fp, str):
+            with open(fp, "wb") as f:
+                f.write(gif)
+        else:
+            fp.write(gif)
 
+    Sticker._render = _render
     Sticker.to_gif = _to_gif
@@ -1,10 +1,11 @@
 #==================================================================================================================================================
 
 class Object:
-    def __init__(self, id, **kwargs):
+    __slots__ = ("_id", "_state")
+
+    def __init__(self, id, *, _state=None):
         self._id = id
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        self._state = _state
 
     @property
     def id(self):
@@ -22,14 +23,25 @@ class Object:
 #==================================================================================================================================================
 
 class Messageable:
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     async def send(self, content):
-        raw_messages = await self._state.http.send_message(self, content)
-        return [await self._state.parse_send_message(rm, content) for rm in raw_messages]
+        fut = await self.queue_send(content)
+        return await fut
+
+    async def queue_send(self, content):
+        '''
+        Queue content to be sent and return a future resolving to the sent messages.
+        This only waits while the send queue is full.
+        '''
+        return await self._state.queue_send(self, content)
 
 class OneToOneMixin(Messageable):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -37,6 +49,8 @@ class OneToOneMixin(Messageable):
         return {"other_user_fbid": self._id}
 
 class GroupMixin(Messageable):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
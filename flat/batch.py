@@ -0,0 +1,60 @@
+import asyncio
+
+__all__ = ("Batcher",)
+
+#==================================================================================================================================================
+
+class Batcher:
+    '''
+    Collect items submitted within a short window (or until max_size items are waiting)
+    and run them through func in a single call.
+    func takes a list of items and returns a list of results in the same order.
+    A result that is an exception instance is raised to that item's caller only.
+    Bursts larger than max_size are split into chunks that run in parallel.
+    '''
+    def __init__(self, func, *, max_size=50, delay=0.01, loop=None):
+        if max_size < 1:
+            raise ValueError("max_size must be positive.")
+        self.loop = loop or asyncio.get_event_loop()
+        self.func = func
+        self.max_size = max_size
+        self.delay = delay
+        self._pending = []
+        self._handle = None
+
+    def submit(self, item):
+        fut = self.loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._handle is None:
+            self._handle = self.loop.call_later(self.delay, self.flush)
+        return fut
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            self.loop.create_task(self._run(pending))
+
+    async def _run(self, pending):
+        try:
+            results = await self.func([item for item, fut in pending])
+        except Exception as e:
+            for item, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (item, fut), result in zip(pending, results):
+                if fut.done():
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+        finally:
+            for item, fut in pending:
+                if not fut.done():
+                    fut.cancel()
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import time
+
+__all__ = ("MessageCache", "LRUCache", "SingleFlight")
+
+_MISSING = object()
+
+#==================================================================================================================================================
+
+class MessageCache:
+    '''
+    Bounded id -> Message mapping that keeps its eviction order alongside the index,
+    so lookup, insertion and eviction are all O(1).
+    Eviction is FIFO by default, or LRU when lru is True.
+    '''
+    def __init__(self, maxlen=None, *, lru=False):
+        self.maxlen = maxlen
+        self.lru = lru
+        self._data = collections.OrderedDict()
+
+    def append(self, message):
+        data = self._data
+        mid = message.id
+        data[mid] = message
+        data.move_to_end(mid)
+        maxlen = self.maxlen
+        if maxlen is not None:
+            while len(data) > maxlen:
+                data.popitem(last=False)
+
+    def get(self, message_id, default=None):
+        data = self._data
+        try:
+            m = data[message_id]
+        except KeyError:
+            return default
+        if self.lru:
+            data.move_to_end(message_id)
+        return m
+
+    def pop(self, message_id, default=None):
+        return self._data.pop(message_id, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, message_id):
+        return message_id in self._data
+
+    def __iter__(self):
+        return iter(self._data.values())
+
+    def __reversed__(self):
+        return reversed(self._data.values())
+
+    def __len__(self):
+        return len(self._data)
+
+#==================================================================================================================================================
+
+class LRUCache:
+    '''
+    Dict-like mapping bounded by size and by idle time.
+    Reading or writing an entry marks it as recently used and restarts its ttl,
+    so the least recently used entries are evicted first. Pinned keys are never evicted.
+    '''
+    def __init__(self, maxsize=None, *, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._pinned = set()
+
+    def _expires(self):
+        ttl = self.ttl
+        return None if ttl is None else time.monotonic() + ttl
+
+    def _is_expired(self, key, expires):
+        return expires is not None and key not in self._pinned and expires <= time.monotonic()
+
+    def __getitem__(self, key):
+        data = self._data
+        value, expires = data[key]
+        if self._is_expired(key, expires):
+            del data[key]
+            raise KeyError(key)
+        data[key] = (value, self._expires())
+        data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data[key] = (value, self._expires())
+        data.move_to_end(key)
+        self._evict()
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._pinned.discard(key)
+
+    def pop(self, key, default=_MISSING):
+        try:
+            value, expires = self._data.pop(key)
+        except KeyError:
+            if default is _MISSING:
+                raise
+            return default
+        self._pinned.discard(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            return False
+        return not self._is_expired(key, expires)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def keys(self):
+        return list(self._data)
+
+    def values(self):
+        return [value for value, expires in self._data.values()]
+
+    def items(self):
+        return [(key, value) for key, (value, expires) in self._data.items()]
+
+    def clear(self):
+        self._data.clear()
+
+    def pin(self, key):
+        self._pinned.add(key)
+
+    def unpin(self, key):
+        self._pinned.discard(key)
+
+    def _evict(self):
+        data = self._data
+        pinned = self._pinned
+        maxsize = self.maxsize
+        now = time.monotonic()
+        skipped = 0
+        #entries are kept in access order and share one ttl, so expired ones are always at the front
+        while data and skipped < len(pinned) + 1:
+            key, (value, expires) = next(iter(data.items()))
+            if key in pinned:
+                data.move_to_end(key)
+                skipped += 1
+            elif (expires is not None and expires <= now) or (maxsize is not None and len(data) > maxsize):
+                del data[key]
+            else:
+                break
+
+#==================================================================================================================================================
+
+class SingleFlight:
+    '''
+    Deduplicate concurrent fetches by key.
+    Callers asking for a key that is already being fetched share the in-flight result
+    instead of issuing another request, while different keys proceed in parallel.
+    '''
+    def __init__(self, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self._calls = {}
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    async def do(self, key, func, *args, **kwargs):
+        fut = self._calls.get(key)
+        if fut is None:
+            fut = self.loop.create_task(func(*args, **kwargs))
+            self._calls[key] = fut
+            fut.add_done_callback(lambda f: self._calls.pop(key, None))
+        #shield so a cancelled caller doesn't cancel the fetch for everyone else
+        return await asyncio.shield(fut)
+
+    async def do_many(self, keys, func):
+        '''
+        func is called with the list of keys that are not already in flight
+        and must return a key -> result mapping.
+        '''
+        calls = self._calls
+        waiting = {}
+        missing = []
+        for key in keys:
+            if key in waiting:
+                continue
+            fut = calls.get(key)
+            if fut is None:
+                fut = self.loop.create_future()
+                calls[key] = fut
+                missing.append(key)
+            waiting[key] = fut
+
+        if missing:
+            task = self.loop.create_task(func(missing))
+            task.add_done_callback(lambda t: self._resolve_many(missing, t))
+
+        #wait for every key, so no future is left with an exception nobody retrieved
+        results = await asyncio.shield(asyncio.gather(*waiting.values(), return_exceptions=True))
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        return dict(zip(waiting, results))
+
+    def _resolve_many(self, keys, task):
+        calls = self._calls
+        for key in keys:
+            fut = calls.pop(key, None)
+            if fut is None or fut.done():
+                continue
+            if task.cancelled():
+                fut.cancel()
+            elif task.exception() is not None:
+                fut.set_exception(task.exception())
+            else:
+                try:
+                    fut.set_result(task.result()[key])
+                except KeyError:
+                    fut.set_exception(KeyError(key))
@@ -1,4 +1,5 @@
 from . import http, state, error
+from .enums import OverflowPolicy
 import asyncio
 import traceback
 import inspect
@@ -14,11 +15,66 @@ def _always_true(*args):
 
 #==================================================================================================================================================
 
+#every option Client accepts besides loop, max_messages and save_cookies, with its default
+OPTIONS = {
+    #pull loop
+    "min_ping_interval": 5,
+    "max_ping_interval": 60,
+    "edge_failure_threshold": 3,
+    "edge_reset_timeout": 30,
+    #connections and request scheduling
+    "api_lane": {},
+    "pull_lane": {},
+    "max_concurrency": 16,
+    "priority_aging": 5,
+    "rate_limits": {},
+    "retry_policy": None,
+    "retry_budget": None,
+    "graphql_batch_size": 20,
+    "graphql_batch_delay": 0.01,
+    "user_batch_size": 50,
+    "user_batch_delay": 0.01,
+    #event and send queues
+    "event_workers": 4,
+    "event_queue_size": 1000,
+    "event_overflow": OverflowPolicy.BLOCK,
+    "send_workers": 8,
+    "send_queue_size": 100,
+    #in-memory caches
+    "lru_messages": False,
+    "max_users": None,
+    "max_threads": None,
+    "user_expiry": None,
+    "thread_expiry": None,
+    "pinned_threads": (),
+    "embed_cache_size": 256,
+    "embed_cache_ttl": 3600,
+    "image_url_cache_size": 1024,
+    "image_url_ttl": 3600,
+    "sticker_cache_size": 128,
+    #persistent caches
+    "cache_path": None,
+    "user_cache_ttl": 86400,
+    "thread_cache_ttl": 3600,
+    "sticker_cache_dir": None,
+    "sticker_executor": None,
+    #uploads
+    "max_concurrent_uploads": 4,
+    "upload_cache_size": 512,
+    "upload_cache_ttl": 86400,
+    "upload_rejected_errors": http.UPLOAD_REJECTED_ERRORS
+}
+
 class Client:
     '''
     This is heavily influenced by discord.py, or more like most are blatantly copy-pasted.
+    Tuning options are passed as keyword arguments, see OPTIONS for the full list and their defaults.
+    Unknown options raise TypeError.
     '''
-    def __init__(self, *, loop=None, max_messages=1000, save_cookies=None):
+    def __init__(self, *, loop=None, max_messages=1000, save_cookies=None, **options):
+        unknown = set(options).difference(OPTIONS)
+        if unknown:
+            raise TypeError("Unknown client option(s): {}.".format(", ".join(sorted(unknown))))
         self.loop = loop or asyncio.get_event_loop()
 
         self._wait_events = {}
@@ -27,6 +83,12 @@ class Client:
         self._ready = asyncio.Event()
         self._max_messages = max_messages
         self._save_cookies = save_cookies
+        self._options = options
+
+        self._min_ping_interval = options.get("min_ping_interval", 5)
+        self._max_ping_interval = options.get("max_ping_interval", 60)
+        self._pull_hold = None
+        self._ping_task = None
 
         for name, member in inspect.getmembers(self):
             if name.startswith("on_"):
@@ -101,8 +163,8 @@ class Client:
         else:
             cookie_jar = None
 
-        self._http = http.HTTPRequest(loop=self.loop, cookie_jar=cookie_jar, save_cookies=self._save_cookies)
-        self._state = state.State(loop=self.loop, http=self._http, dispatch=self.dispatch, max_messages=self._max_messages)
+        self._http = http.HTTPRequest(loop=self.loop, cookie_jar=cookie_jar, save_cookies=self._save_cookies, dispatch=self.dispatch, **self._options)
+        self._state = state.State(loop=self.loop, http=self._http, dispatch=self.dispatch, max_messages=self._max_messages, **self._options)
         if not cookie_jar:
             await self._http.login(email, password)
         else:
@@ -113,27 +175,54 @@ class Client:
         self._ready.set()
         self.dispatch("ready")
 
-        def retry():
-            t = 0
-            while True:
-                if t < 60:
-                    yield t
-                    t += 10
-                else:
-                    yield 60
+        await self._pull_loop()
+
+    def _record_pull_hold(self, hold):
+        #exponential moving average of how long the server held each pull
+        if self._pull_hold is None:
+            self._pull_hold = hold
+        else:
+            self._pull_hold += (hold - self._pull_hold) * 0.2
+
+    def _next_ping_interval(self):
+        hold = self._pull_hold
+        if hold is None:
+            return self._min_ping_interval
+        return min(max(hold, self._min_ping_interval), self._max_ping_interval)
 
+    async def _keep_alive(self):
         while self.is_running():
             try:
                 await self._http.ping()
-                raw = await self._http.pull()
-            except asyncio.TimeoutError:
-                continue
             except asyncio.CancelledError:
                 return
-            except:
-                raise
-            else:
-                self.loop.create_task(self._state.process_raw_data(raw))
+            except Exception:
+                log.warning("Active ping failed.", exc_info=True)
+            await asyncio.sleep(self._next_ping_interval())
+
+    async def _pull_loop(self):
+        #active_ping runs on its own timer so the next pull goes out as soon as the previous one returns
+        self._ping_task = self.loop.create_task(self._keep_alive())
+        try:
+            while self.is_running():
+                started = self.loop.time()
+                try:
+                    raw = await self._http.pull()
+                except asyncio.TimeoutError:
+                    self._record_pull_hold(self.loop.time() - started)
+                    continue
+                except asyncio.CancelledError:
+                    return
+                except Exception:
+                    #a pull still in flight when the client closes fails with the session, that is expected
+                    if not self.is_running():
+                        return
+                    raise
+                else:
+                    self._record_pull_hold(self.loop.time() - started)
+                    await self._state.process_raw_data(raw)
+        finally:
+            self._ping_task.cancel()
 
     #
     #this part is directly copy from discord.py
@@ -223,12 +312,14 @@ class Client:
     #
 
     async def close(self):
+        #stop the pull loop first, so nothing new reaches the state while it shuts down
+        self._closed.set()
         if self._save_cookies:
             self._http.session.cookie_jar.save(self._save_cookies)
         else:
             await self._http.logout()
+        await self._state.close()
         await self._http.close()
-        self._closed.set()
         self._ready.clear()
 
     async def on_ready(self):
@@ -240,6 +331,16 @@ class Client:
     def get_thread(self, id):
         return self._state.threads.get(id)
 
+    async def prefetch_embeds(self, *urls):
+        '''
+        Warm the embed cache for links that are about to be sent. Links that fail to load are skipped,
+        sending them later simply fetches their data again.
+        '''
+        results = await asyncio.gather(*(self._http.prefetch_embed(url) for url in urls), return_exceptions=True)
+        for url, r in zip(urls, results):
+            if isinstance(r, Exception):
+                log.info("Failed to prefetch embed data of %s: %r", url, r)
+
     def listen(self, func):
         if not inspect.iscoroutinefunction(func):
             raise TypeError("Not a coroutine.")
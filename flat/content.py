@@ -1,7 +1,10 @@
+import asyncio
 import enum
 import os
 import collections
-from io import BytesIO
+import contextlib
+import hashlib
+import io
 import mimetypes
 
 __all__ = ("File", "Content", "Mention", "Bigmoji")
@@ -14,28 +17,114 @@ Bigmoji = collections.namedtuple("Bigmoji", "emoji size")
 
 #==================================================================================================================================================
 
+def _tell(f):
+    try:
+        return f.tell()
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        return None
+
 class File:
+    '''
+    A file to attach. f can be a path, a binary file object, bytes, or an async iterable of bytes chunks.
+    Paths, file objects and async iterables are streamed when uploaded, so they are never fully loaded into memory.
+    '''
     def __init__(self, f, filename=None):
         self.f = f
         self.filename = filename
+        #where a file object starts, so it can be read again; None if it can't seek
+        self._start = _tell(f) if hasattr(f, "read") else None
+
+    @property
+    def name(self):
+        '''
+        The filename the file is uploaded with, if any.
+        '''
+        if self.filename:
+            return self.filename
+        f = self.f
+        name = f if isinstance(f, str) else getattr(f, "name", None)
+        if isinstance(name, str):
+            return os.path.basename(name)
+        else:
+            return None
 
     def read(self):
         f = self.f
         if isinstance(f, str):
-            other, filename = os.path.split(f)
             with open(f, "rb") as fp:
-                return fp.read(), filename
+                return fp.read(), self.name
         else:
             try:
                 b = f.read()
             except AttributeError:
                 return f, self.filename
             else:
-                filename = getattr(f, "name", self.filename)
-                return b, filename
+                return b, self.name
+
+    def cache_key(self):
+        '''
+        Key identifying the content for the upload cache, or None if it cannot be identified without consuming it.
+        Paths are keyed by real path, size and modification time, so they are not read an extra time.
+        Bytes and seekable file objects are keyed by their SHA-256, file objects are rewound afterwards.
+        '''
+        f = self.f
+        if isinstance(f, str):
+            st = os.stat(f)
+            return "path:{}:{}:{}".format(os.path.realpath(f), st.st_size, st.st_mtime_ns)
+        elif isinstance(f, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(f).hexdigest()
+        elif self._start is not None:
+            h = hashlib.sha256()
+            try:
+                f.seek(self._start)
+                for chunk in iter(lambda: f.read(65536), b""):
+                    h.update(chunk)
+                f.seek(self._start)
+            except (io.UnsupportedOperation, OSError):
+                return None
+            return h.hexdigest()
+        else:
+            return None
+
+    def rewind(self):
+        '''
+        Get ready to be read again from the start. Return False if that is not possible,
+        as with async iterables and unseekable streams.
+        '''
+        f = self.f
+        if isinstance(f, (str, bytes, bytearray, memoryview)):
+            return True
+        elif self._start is None:
+            return False
+        try:
+            f.seek(self._start)
+        except (io.UnsupportedOperation, OSError):
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def open(self):
+        '''
+        Context manager yielding (body, filename), where body is suitable for streaming into a form field.
+        A path is opened for the duration of the block.
+        '''
+        f = self.f
+        if isinstance(f, str):
+            with open(f, "rb") as fp:
+                yield fp, self.name
+        else:
+            yield f, self.name
 
 #==================================================================================================================================================
 
+class _AttachmentPayload(dict):
+    #send payload that remembers which file each attachment id field came from
+    __slots__ = ("files",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.files = {}
+
 class Content:
     def __init__(self, text=""):
         self._clear()
@@ -64,7 +153,7 @@ class Content:
 
     def bigmoji(self, emoji, size="small"):
         if size in ("large", "medium", "small"):
-            self._bigmoji = Bigmoji(emoji=e, size=size)
+            self._bigmoji = Bigmoji(emoji=emoji, size=size)
             return self
         else:
             raise ValueError("Emoji size must be either large, medium or small (lowercase).")
@@ -86,71 +175,99 @@ class Content:
         else:
             raise ValueError("This accepts url with http(s) scheme only.")
 
-    async def to_dict(self, http):
-        base = {
+    def _base_dict(self):
+        return {
             "action_type": "ma-type:user-generated-message",
             "body": ""
         }
 
-        data = []
+    async def _text_to_dict(self, http):
+        cur = self._base_dict()
+        cur["body"] = self._text
 
-        if self._text or self._mentions or self._embed_url:
-            cur = base.copy()
-            cur["body"] = self._text
+        for i, m in enumerate(self._mentions):
+            cur["profile_xmd[{}][id]".format(i)] = m.user.id
+            cur["profile_xmd[{}][offset]".format(i)] = m.offset
+            cur["profile_xmd[{}][length]".format(i)] = m.length
+            cur["profile_xmd[{}][type]".format(i)] = "p"
+
+        if self._embed_url:
+            d = await http.fetch_embed_data(self._embed_url)
+            cur.update(d)
+
+        return [cur]
+
+    async def _files_to_dict(self, http):
+        #uploads run concurrently (http bounds how many at once), gather keeps the attachment order
+        metadata = await asyncio.gather(*(http.upload_file(f) for f in self._files))
 
-            for i, m in enumerate(self._mentions):
-                cur["profile_xmd[{}][id]".format(i)] = m.user.id
-                cur["profile_xmd[{}][offset]".format(i)] = m.offset
-                cur["profile_xmd[{}][length]".format(i)] = m.length
-                cur["profile_xmd[{}][type]".format(i)] = "p"
+        cur = {}
+        count = {
+            "image": 0,
+            "gif": 0,
+            "audio": 0,
+            "video": 0,
+            "file": 0
+        }
+
+        for f, d in zip(self._files, metadata):
+            for t in count:
+                file_id = d.get(t+"_id")
+                if file_id:
+                    data_for_this = cur.get(t)
+                    if data_for_this is None:
+                        data_for_this = cur[t] = _AttachmentPayload(self._base_dict())
+                        data_for_this["has_attachment"] = "true"
+                    if t in ("image", "gif"):
+                        c = count["image"] + count["gif"]
+                    else:
+                        c = count[t]
+                    field = "{}_ids[{}]".format(t, c)
+                    data_for_this[field] = file_id
+                    data_for_this.files[field] = f
+                    count[t] += 1
+                    break
+
+        return list(cur.values())
+
+    @staticmethod
+    def _done(value):
+        fut = asyncio.get_event_loop().create_future()
+        fut.set_result(value)
+        return fut
 
-            if self._embed_url:
-                d = await http.fetch_embed_data(self._embed_url)
-                cur.update(d)
+    def prepare(self, http):
+        '''
+        Return the send payloads as a list of awaitables, in send order. Each one resolves to a list of payloads.
+        File uploads start right away, so they overlap with sending the parts before them.
+        '''
+        files = asyncio.ensure_future(self._files_to_dict(http)) if self._files else None
+        parts = []
 
-            data.append(cur)
+        if self._text or self._mentions or self._embed_url:
+            parts.append(asyncio.ensure_future(self._text_to_dict(http)))
 
         if self._bigmoji:
-            cur = base.copy()
+            cur = self._base_dict()
             cur["body"] = self._bigmoji.emoji
             cur["tags[0]"] = "hot_emoji_size:" + self._bigmoji.size
-            data.append(cur)
+            parts.append(self._done([cur]))
 
         if self._sticker_id:
-            cur = base.copy()
+            cur = self._base_dict()
             cur["sticker_id"] = self._sticker_id
             cur["has_attachment"] = "true"
-            data.append(cur)
+            parts.append(self._done([cur]))
 
-        if self._files:
-            cur = []
-            cur["has_attachment"] = "true"
+        if files:
+            parts.append(files)
 
-            count = {
-                "image": 0,
-                "gif": 0,
-                "audio": 0,
-                "video": 0,
-                "file": 0
-            }
-
-            for i, f in enumerate(self._files):
-                d = await http.upload_file(f)
-
-                for t in count.items():
-                    file_id = d.get(t+"_id")
-                    if file_id:
-                        data_for_this = cur.get(t, base.copy())
-                        if t in ("image", "gif"):
-                            c = count["image"] + count["gif"]
-                        else:
-                            c = count[t]
-                        data_for_this["{}_ids[{}]".format(t, c)] = file_id
-                        cur[t] = data_for_this
-                        count[t] = v + 1
-
-            data.extend(cur)
+        return parts
 
+    async def to_dict(self, http):
+        data = []
+        for part in self.prepare(http):
+            data.extend(await part)
         return data
 
     @classmethod
@@ -158,13 +275,11 @@ class Content:
         ctn = cls(message.text)
         ctn._mentions = message.mentions
         if message.bigmoji:
-            ctn.bigmoji(message.bigmoji.id, size=message.bigmoji.size)
+            ctn.bigmoji(message.bigmoji.emoji, size=message.bigmoji.size)
         if message.sticker:
             ctn.add_sticker(message.sticker.id)
         if message.embed_link:
             ctn.embed_link(message.embed_link.url, append=False)
-        for f in message.files:
-            b = BytesIO()
-            await f.save(b)
-            ctn.attach(File(b.getvalue(), f.filename))
+        #the attachments are streamed from their source straight into the upload
+        ctn.attach_file(*(File(f.iter_content(), f.filename) for f in message.files))
         return ctn
@@ -0,0 +1,89 @@
+import time
+
+__all__ = ("EdgeChannel", "EdgeSelector")
+
+#==================================================================================================================================================
+
+class EdgeChannel:
+    def __init__(self, number):
+        self.number = number
+        self.latency = None
+        self.error_rate = 0.0
+        self.timeouts = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+class EdgeSelector:
+    '''
+    Track health of the N-edge-chat.facebook.com hosts and pick which one to long-poll.
+    Each channel keeps a moving average of latency and error rate. A channel whose circuit is open
+    (after a hard failure such as 502/503, or failure_threshold failures in a row) is skipped
+    until a background probe succeeds, and probes are due reset_timeout seconds after it opened.
+    '''
+    def __init__(self, count=6, *, failure_threshold=3, reset_timeout=30, alpha=0.2):
+        self.channels = [EdgeChannel(i) for i in range(count)]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.alpha = alpha
+        self.current = 0
+
+    def _default_latency(self):
+        known = [ch.latency for ch in self.channels if ch.latency is not None]
+        if known:
+            return sum(known) / len(known)
+        else:
+            return 1.0
+
+    def score(self, channel):
+        latency = channel.latency
+        if latency is None:
+            latency = self._default_latency()
+        return latency * (1 + 4 * channel.error_rate)
+
+    def select(self, exclude=()):
+        channels = [ch for ch in self.channels if ch.number not in exclude] or self.channels
+        candidates = [ch for ch in channels if not ch.is_open]
+        if candidates:
+            best = min(candidates, key=self.score)
+            current = self.channels[self.current]
+            #only move off the current channel when another one is clearly healthier, to avoid flapping
+            if current in candidates and self.score(current) <= self.score(best) * 1.5:
+                best = current
+        else:
+            #every circuit is open, try the one that failed longest ago
+            best = min(channels, key=lambda ch: ch.opened_at)
+        self.current = best.number
+        return best.number
+
+    def record_success(self, number, latency=None):
+        ch = self.channels[number]
+        alpha = self.alpha
+        ch.consecutive_failures = 0
+        ch.error_rate *= 1 - alpha
+        ch.opened_at = None
+        if latency is not None:
+            if ch.latency is None:
+                ch.latency = latency
+            else:
+                ch.latency += (latency - ch.latency) * alpha
+
+    def record_failure(self, number, *, timeout=False, hard=False):
+        ch = self.channels[number]
+        alpha = self.alpha
+        ch.consecutive_failures += 1
+        ch.error_rate = ch.error_rate * (1 - alpha) + alpha
+        if timeout:
+            ch.timeouts += 1
+        if hard or ch.consecutive_failures >= self.failure_threshold:
+            ch.opened_at = time.monotonic()
+
+    def has_open(self):
+        return any(ch.is_open for ch in self.channels)
+
+    def due_for_probe(self):
+        now = time.monotonic()
+        return [ch.number for ch in self.channels if ch.is_open and now - ch.opened_at >= self.reset_timeout]
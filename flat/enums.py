@@ -1,9 +1,26 @@
 import enum
 
+__all__ = ("Gender", "OverflowPolicy", "RetryAction", "Priority")
+
 #==================================================================================================================================================
 
 class Gender(enum.Enum):
     FEMALE = 1
     MALE = 2
     UNDEFINED = 3
-    UNKNOWN = 7
\ No newline at end of file
+    UNKNOWN = 7
+
+class OverflowPolicy(enum.Enum):
+    BLOCK = 1
+    DROP_NEWEST = 2
+    DROP_OLDEST = 3
+
+class RetryAction(enum.Enum):
+    RETRY = 1
+    RELOGIN = 2
+    FATAL = 3
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    NORMAL = 1
+    BACKGROUND = 2
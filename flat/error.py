@@ -30,4 +30,10 @@ class SendFailure(HTTPException):
 class UnexpectedResponse(HTTPException):
     pass
 
+class ErrorResponse(HTTPException):
+    def __init__(self, data):
+        self.data = data
+        self.code = data.get("error")
+        self.message = data.get("errorSummary") or "Facebook returned error {}.".format(self.code)
+
 #==================================================================================================================================================
@@ -1,16 +1,21 @@
 import aiohttp
 import asyncio
 from bs4 import BeautifulSoup as BS
-from . import error, content, utils
+from . import error, content, utils, batch
+from .cache import LRUCache, SingleFlight
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy, RetryBudget, RetryEvent
+from .enums import RetryAction, Priority
+from .scheduler import PrioritySemaphore
+from .edge import EdgeSelector
 import random
 import re
 import json
 import mimetypes
 import time
-import json
-import re
-import functools
-import traceback
+import logging
+
+log = logging.getLogger(__name__)
 
 #==================================================================================================================================================
 
@@ -61,16 +66,31 @@ def generate_offline_threading_id():
     v = random.randrange(0xffffffff)
     return (t << 22) + (v & 0x7ffff)
 
-def strip_to_json(s):
-    start = "[{"
-    for i, c in enumerate(s):
-        if c in start:
-            return s[i:]
+def _find_json_start(s):
+    if isinstance(s, str):
+        brace, bracket = s.find("{"), s.find("[")
     else:
+        brace, bracket = s.find(b"{"), s.find(b"[")
+    if brace < 0:
+        return bracket
+    elif bracket < 0:
+        return brace
+    else:
+        return min(brace, bracket)
+
+def strip_to_json(s):
+    i = _find_json_start(s)
+    if i < 0:
         return None
+    else:
+        return s[i:]
 
 def load_broken_json(b):
-    return json.loads(strip_to_json(b.decode("utf-8")))
+    #skip the "for (;;);" guard with a native search and hand a view of the rest to the parser, no copy
+    i = _find_json_start(b)
+    if i < 0:
+        raise error.UnexpectedResponse("Response does not contain JSON.")
+    return utils.from_json(memoryview(b)[i:])
 
 def get_jsmods_require(d, index, default=None):
     try:
@@ -120,7 +140,13 @@ class ConcatJSONDecoder(json.JSONDecoder):
             objs.append(obj)
         return objs
 
-load_concat_json = functools.partial(json.loads, cls=ConcatJSONDecoder)
+def load_concat_json(b):
+    #graphqlbatch puts one object per line, so let the json backend parse each line on its own
+    #and only fall back to the pure python concat decoder when that doesn't hold
+    try:
+        return [utils.from_json(line) for line in b.splitlines() if line.strip()]
+    except ValueError:
+        return json.loads(b, cls=ConcatJSONDecoder)
 
 #==================================================================================================================================================
 
@@ -264,6 +290,37 @@ class GraphQL:
             }
         )
 
+#send error codes meaning attachment ids were not accepted, cached ids are dropped and the files uploaded again
+UPLOAD_REJECTED_ERRORS = (1545003, 1545010)
+
+#endpoint name -> (requests per second, burst), anything not listed is not rate limited
+DEFAULT_RATE_LIMITS = {
+    "SEND": (5, 10),
+    "USER_INFO": (5, 10),
+    "GRAPHQL": (5, 10),
+    "UPLOAD": (2, 5),
+    "ATTACHMENT_PHOTO": (5, 10),
+    "EMBED_LINK": (5, 10)
+}
+
+#connection settings for the two lanes: "api" for regular requests, "pull" for long-polling the edge-chat hosts
+DEFAULT_LANES = {
+    "api": {
+        "limit": 100,
+        "limit_per_host": 0,
+        "keepalive_timeout": 15,
+        "ttl_dns_cache": 300,
+        "timeout": 30
+    },
+    "pull": {
+        "limit": 10,
+        "limit_per_host": 4,
+        "keepalive_timeout": 75,
+        "ttl_dns_cache": 60,
+        "timeout": 30
+    }
+}
+
 #==================================================================================================================================================
 
 #partially stolen from fbchat, and converted to aiohttp
@@ -306,9 +363,15 @@ class HTTPRequest:
     EMBED_LINK = "https://www.facebook.com/message_share_attachment/fromURI/"
     MARK_FOLDER_AS_READ = "https://www.facebook.com/ajax/mercury/mark_folder_as_read.php?dpr=1"
 
-    def __init__(self, *, loop=None, user_agent=None, cookie_jar=None, save_cookies=None):
+    def __init__(self, *, loop=None, user_agent=None, cookie_jar=None, save_cookies=None, dispatch=None, **options):
         self.loop = loop or asyncio.get_event_loop()
-        self.pull_channel = 0
+        self.dispatch = dispatch or (lambda *args: None)
+        self.edge = EdgeSelector(
+            failure_threshold=options.get("edge_failure_threshold", 3),
+            reset_timeout=options.get("edge_reset_timeout", 30)
+        )
+        self.pull_channel = self.edge.current
+        self._edge_probe = None
         self.client = "mercury"
         self.headers = {
             "Content-Type" : "application/x-www-form-urlencoded",
@@ -321,19 +384,74 @@ class HTTPRequest:
         self.pool = None
         self.cookie_jar = cookie_jar
         self.save_cookies = save_cookies
+        self.lanes = {}
+        for name, default in DEFAULT_LANES.items():
+            lane = default.copy()
+            lane.update(options.get(name + "_lane", {}))
+            self.lanes[name] = lane
+        self._graphql_batcher = batch.Batcher(
+            self._graphql_batch,
+            max_size=options.get("graphql_batch_size", 20),
+            delay=options.get("graphql_batch_delay", 0.01),
+            loop=self.loop
+        )
+        rate_limits = DEFAULT_RATE_LIMITS.copy()
+        rate_limits.update(options.get("rate_limits", {}))
+        self.ratelimiter = RateLimiter(rate_limits)
+        self.upload_slots = asyncio.Semaphore(options.get("max_concurrent_uploads", 4))
+        #content hash -> (upload metadata, expiry timestamp)
+        self.upload_cache = LRUCache(options.get("upload_cache_size", 512))
+        self.upload_cache_ttl = options.get("upload_cache_ttl", 86400)
+        self.upload_store = None
+        self.upload_hits = 0
+        self.upload_misses = 0
+        self.upload_rejected_errors = options.get("upload_rejected_errors", UPLOAD_REJECTED_ERRORS)
+        self._upload_flight = SingleFlight(loop=self.loop)
+        #url -> (flattened share data, expiry timestamp)
+        self.embed_cache = LRUCache(options.get("embed_cache_size", 256))
+        self.embed_cache_ttl = options.get("embed_cache_ttl", 3600)
+        self._embed_flight = SingleFlight(loop=self.loop)
+        #image id -> (url, expiry timestamp)
+        self.image_urls = LRUCache(options.get("image_url_cache_size", 1024))
+        self.image_url_ttl = options.get("image_url_ttl", 3600)
+        self._image_flight = SingleFlight(loop=self.loop)
+        #bounds concurrent api-lane requests, handing free slots to interactive requests first
+        self.api_slots = PrioritySemaphore(
+            options.get("max_concurrency", 16),
+            aging=options.get("priority_aging", 5),
+            loop=self.loop
+        )
+        self.retry_policy = options.get("retry_policy") or RetryPolicy()
+        self.retry_budget = options.get("retry_budget") or RetryBudget()
+        #edge requests fail over to another channel instead of retrying the same one
+        self._edge_retry = self.retry_policy.replace(max_attempts=1)
+        self._endpoints = {getattr(self, name): name for name in dir(self) if name.isupper() and isinstance(getattr(self, name), str)}
         self.clear()
 
-    def change_pull_channel(self):
-        self.pull_channel = (self.pull_channel + 1) % 6
+    def _make_session(self, lane, cookie_jar):
+        connector = aiohttp.TCPConnector(
+            loop=self.loop,
+            limit=lane["limit"],
+            limit_per_host=lane["limit_per_host"],
+            keepalive_timeout=lane["keepalive_timeout"],
+            ttl_dns_cache=lane["ttl_dns_cache"]
+        )
+        return aiohttp.ClientSession(loop=self.loop, cookie_jar=cookie_jar, connector=connector)
 
     def clear(self):
-        self.session = aiohttp.ClientSession(loop=self.loop, cookie_jar=self.cookie_jar)
+        #long-held pulls get their own connection pool so they never hold up sends and api calls
+        cookie_jar = self.cookie_jar or aiohttp.CookieJar(loop=self.loop)
+        self.session = self._make_session(self.lanes["api"], cookie_jar)
+        self.pull_session = self._make_session(self.lanes["pull"], cookie_jar)
         self.params = {}
         self.request_counter = 1
         self.seq = "0"
 
     async def close(self):
+        if self._edge_probe:
+            self._edge_probe.cancel()
         await self.session.close()
+        await self.pull_session.close()
 
     def update_params(self, extra={}):
         params = self.params.copy()
@@ -343,55 +461,133 @@ class HTTPRequest:
         self.request_counter += 1
         return params
 
-    def retries_wrap(times, *, verbose=True):
-        def wrapped(func):
-            @functools.wraps(func)
-            async def new_func(self, *args, **kwargs):
-                for i in range(times):
-                    try:
-                        return await func(self, *args, **kwargs)
-                    except (asyncio.TimeoutError, KeyboardInterrupt, RuntimeError, asyncio.CancelledError):
-                        raise
-                    except error.HTTPRequestFailure as e:
-                        status = e.response.status
-                        if status in (502, 503):
-                            self.change_pull_channel()
-                        elif status == 1357004:
-                            await self.save_login_state()
-                        continue
-                    except Exception as e:
-                        if verbose:
-                            print("Ignoring {}\n{}Retrying... ({}/{})\n".format(type(e), "".join(traceback.format_exception(type(e), e, e.__traceback__, 5)), i+1, times))
-                else:
-                    raise error.HTTPException("Cannot send HTTP request.")
-            return new_func
-        return wrapped
-
-    @retries_wrap(3)
-    async def get(self, url, *, headers=None, params=None, timeout=30, as_json=False, json_decoder=load_broken_json, **kwargs):
+    async def _retry(self, policy, method, url, func, *, idempotent=True):
+        policy = policy or self.retry_policy
+        budget = self.retry_budget
+        budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                ret = await func()
+                #facebook reports some failures, like an expired session, as an error payload with status 200
+                if isinstance(ret, dict) and ret.get("error") in policy.statuses:
+                    raise error.ErrorResponse(ret)
+                return ret
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                action = policy.classify(e, idempotent=idempotent)
+                if action is RetryAction.FATAL:
+                    if isinstance(e, error.ErrorResponse):
+                        #leave error payloads nobody asked to retry to the caller, as before
+                        return e.data
+                    raise
+                if attempt >= policy.max_attempts or not budget.withdraw():
+                    raise error.HTTPException("Cannot send HTTP request to {} after {} attempt(s).".format(url, attempt)) from e
+
+                delay = policy.get_delay(attempt)
+                log.info("%s %s failed with %r, retrying in %.2fs (%d/%d).", method, url, e, delay, attempt, policy.max_attempts)
+                self.dispatch("http_retry", RetryEvent(method, url, attempt, delay, action, e))
+
+                if action is RetryAction.RELOGIN:
+                    await self.save_login_state()
+                await asyncio.sleep(delay)
+
+    async def _request(
+        self, method, url, *, headers=None, timeout=None, lane="api", priority=Priority.NORMAL,
+        as_json=False, json_decoder=load_broken_json, **kwargs
+    ):
         headers = headers or self.headers
-        params = self.update_params(params or {})
-        async with self.session.get(url, headers=headers, params=params, timeout=timeout, **kwargs) as response:
-            if response.status != 200:
-                raise error.HTTPRequestFailure(response)
-            bytes_ = await response.read()
-            if as_json:
-                return json_decoder(bytes_)
+        timeout = aiohttp.ClientTimeout(total=timeout or self.lanes[lane]["timeout"])
+        if lane == "pull":
+            async with self.pull_session.request(method, url, headers=headers, timeout=timeout, **kwargs) as response:
+                if response.status != 200:
+                    raise error.HTTPRequestFailure(response)
+                bytes_ = await response.read()
+            return json_decoder(bytes_) if as_json else bytes_
+
+        endpoint = self._endpoints.get(url)
+        ratelimiter = self.ratelimiter
+        await ratelimiter.acquire(endpoint, priority)
+        async with self.api_slots.slot(priority):
+            async with self.session.request(method, url, headers=headers, timeout=timeout, **kwargs) as response:
+                if response.status != 200:
+                    if response.status == 429 or response.status >= 500:
+                        ratelimiter.penalize(endpoint)
+                    raise error.HTTPRequestFailure(response)
+                bytes_ = await response.read()
+
+        if as_json:
+            d = json_decoder(bytes_)
+            #facebook mostly reports throttling as an error payload with status 200
+            if isinstance(d, dict) and d.get("error"):
+                ratelimiter.penalize(endpoint)
             else:
-                return bytes_
+                ratelimiter.reward(endpoint)
+            return d
+        else:
+            ratelimiter.reward(endpoint)
+            return bytes_
 
-    @retries_wrap(3)
-    async def post(self, url, *, headers=None, data=None, timeout=30, as_json=False, json_decoder=load_broken_json, **kwargs):
-        headers = headers or self.headers
-        data = self.update_params(data or {})
-        async with self.session.post(url, headers=headers, data=data, timeout=timeout, **kwargs) as response:
-            if response.status != 200:
-                raise error.HTTPRequestFailure(response)
-            bytes_ = await response.read()
-            if as_json:
-                return json_decoder(bytes_)
-            else:
-                return bytes_
+    async def get(self, url, *, params=None, retry=None, **kwargs):
+        return await self._retry(retry, "GET", url, lambda: self._request("GET", url, params=self.update_params(params or {}), **kwargs))
+
+    async def post(self, url, *, data=None, retry=None, idempotent=True, **kwargs):
+        return await self._retry(
+            retry, "POST", url, lambda: self._request("POST", url, data=self.update_params(data or {}), **kwargs),
+            idempotent=idempotent
+        )
+
+    async def stream(self, url, *, chunk_size=65536, offset=0, retry=None):
+        '''
+        Async iterator over the body of url in chunks, starting from byte offset.
+        If the connection drops midway, the download resumes from the last received byte with a Range request.
+        '''
+        policy = retry or self.retry_policy
+        budget = self.retry_budget
+        budget.deposit()
+        #no total timeout, a large download can legitimately take a while
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.lanes["api"]["timeout"])
+        attempt = 0
+        while True:
+            attempt += 1
+            headers = self.headers.copy()
+            if offset:
+                headers["Range"] = "bytes={}-".format(offset)
+            try:
+                async with self.session.get(url, headers=headers, timeout=timeout) as response:
+                    if response.status == 416:
+                        #offset is already past the end, nothing left to fetch
+                        return
+                    if response.status not in (200, 206):
+                        raise error.HTTPRequestFailure(response)
+
+                    #the server may ignore Range and send everything, so skip what was already received
+                    skip = offset if response.status == 200 else 0
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        offset += len(chunk)
+                        yield chunk
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                action = policy.classify(e)
+                if action is not RetryAction.RETRY:
+                    raise
+                if attempt >= policy.max_attempts or not budget.withdraw():
+                    raise error.HTTPException("Cannot download {} after {} attempt(s).".format(url, attempt)) from e
+
+                delay = policy.get_delay(attempt)
+                log.info("GET %s failed at byte %d with %r, resuming in %.2fs (%d/%d).", url, offset, e, delay, attempt, policy.max_attempts)
+                self.dispatch("http_retry", RetryEvent("GET", url, attempt, delay, action, e))
+                await asyncio.sleep(delay)
 
     async def login(self, username, password):
         if username and password:
@@ -554,56 +750,220 @@ class HTTPRequest:
         }
 
         data.update(dest.to_dict())
-        send_data = await ctn.to_dict(self)
+        parts = ctn.prepare(self)
 
         ms = []
-        for sd in send_data:
-            sd.update(data)
-            d = await self.post(self.SEND, data=sd, as_json=True)
-            fb_dtsg = get_jsmods_require(d, 2)
-            if fb_dtsg is not None:
-                self.params["fb_dtsg"] = fb_dtsg
-            try:
-                send = [m for m in d["payload"]["actions"] if m]
-            except:
-                continue
-            else:
-                ms.extend(send)
+        try:
+            for part in parts:
+                payloads = await part
+                for sd in payloads:
+                    sd.update(data)
+                    d = await self.post(self.SEND, data=sd, as_json=True, priority=Priority.INTERACTIVE, idempotent=False)
+                    if d.get("error") in self.upload_rejected_errors and await self._reupload(sd):
+                        #cached attachment ids were rejected, resend once with freshly uploaded ones
+                        d = await self.post(self.SEND, data=sd, as_json=True, priority=Priority.INTERACTIVE, idempotent=False)
+                    fb_dtsg = get_jsmods_require(d, 2)
+                    if fb_dtsg is not None:
+                        self.params["fb_dtsg"] = fb_dtsg
+                    try:
+                        send = [m for m in d["payload"]["actions"] if m]
+                    except:
+                        continue
+                    else:
+                        ms.extend(send)
+        finally:
+            for part in parts:
+                part.cancel()
         return ms
 
-    async def fetch_embed_data(self, url):
+    async def fetch_embed_data(self, url, *, priority=Priority.INTERACTIVE):
+        cached = self.embed_cache.get(url)
+        if cached is not None:
+            data, expires = cached
+            if expires > time.time():
+                return data.copy()
+            del self.embed_cache[url]
+        #flights are per priority, so a send never waits at background priority behind a prefetch
+        data = await self._embed_flight.do((url, priority), self._fetch_embed_data, url, priority)
+        return data.copy()
+
+    async def _fetch_embed_data(self, url, priority):
         ret = await self.post(
             self.EMBED_LINK,
             data={"uri": url, "image_height": 960, "image_width": 960},
-            as_json=True
+            as_json=True,
+            priority=priority
         )
         share_data = ret["payload"]["share_data"]
-        return flatten(share_data, "shareable_attachment")
+        data = flatten(share_data, "shareable_attachment")
+        self.embed_cache[url] = (data, time.time() + self.embed_cache_ttl)
+        return data
+
+    async def prefetch_embed(self, url):
+        '''
+        Fetch and cache the embed data of url in the background, so a later send with this link only needs one request.
+        '''
+        await self.fetch_embed_data(url, priority=Priority.BACKGROUND)
 
     async def upload_file(self, f):
-        b, filename = f.read()
-        if not filename:
-            filename = "file_" + str(i)
-            content_type = None
-        else:
-            content_type = mimetypes.guess_type(filename)[0]
+        '''
+        Upload f and return its metadata. Files with the same content and filename reuse the ids
+        of an earlier upload until upload_cache_ttl runs out.
+        '''
+        cache_key = await self.loop.run_in_executor(None, f.cache_key)
+        if cache_key is None:
+            self.upload_misses += 1
+            return await self._upload_file_slotted(f)
+
+        key = "{}:{}".format(cache_key, f.name or "")
+        metadata = await self._get_cached_upload(key)
+        if metadata is not None:
+            self.upload_hits += 1
+            return metadata
+
+        self.upload_misses += 1
+        return await self._upload_flight.do(key, self._upload_and_cache, key, f)
+
+    async def _get_cached_upload(self, key):
+        now = time.time()
+        cached = self.upload_cache.get(key)
+        if cached is not None:
+            metadata, expires = cached
+            if expires > now:
+                return metadata
+            del self.upload_cache[key]
+
+        if self.upload_store:
+            cached = await self.upload_store.get("upload", key)
+            #expired ids are useless, unlike users and threads they cannot be revalidated
+            if cached is not None and not cached[1]:
+                metadata, expires = cached[0]
+                self.upload_cache[key] = (metadata, expires)
+                return metadata
+        return None
 
+    async def _upload_and_cache(self, key, f):
+        metadata = await self._upload_file_slotted(f)
+        ttl = self.upload_cache_ttl
+        self.upload_cache[key] = (metadata, time.time() + ttl)
+        if self.upload_store:
+            await self.upload_store.put("upload", key, (metadata, time.time() + ttl), ttl=ttl)
+        return metadata
+
+    async def forget_uploads(self, payload):
+        '''
+        Drop cached uploads whose ids appear in a send payload. Return the payload fields holding those ids.
+        '''
+        fields = {k: str(v) for k, v in payload.items() if "_ids[" in k}
+        dropped = set()
+        keys = []
+        for key, (metadata, expires) in self.upload_cache.items():
+            ids = {str(v) for v in metadata.values() if isinstance(v, (str, int))}
+            hit = [k for k, v in fields.items() if v in ids]
+            if hit:
+                keys.append(key)
+                dropped.update(hit)
+
+        for key in keys:
+            del self.upload_cache[key]
+            if self.upload_store:
+                await self.upload_store.delete("upload", key)
+        return [k for k in fields if k in dropped]
+
+    async def _reupload(self, payload):
+        #swap the cached ids in payload for fresh uploads, as long as every affected file can be read again
+        files = getattr(payload, "files", None)
+        if not files:
+            return False
+        fields = await self.forget_uploads(payload)
+        if not fields or not all(files[field].rewind() for field in fields):
+            return False
+
+        metadata = await asyncio.gather(*(self.upload_file(files[field]) for field in fields))
+        for field, d in zip(fields, metadata):
+            file_id = d.get(field.partition("_ids[")[0] + "_id")
+            if not file_id:
+                return False
+            payload[field] = file_id
+        return True
+
+    async def _upload_file_slotted(self, f):
+        async with self.upload_slots:
+            return await self._upload_file(f)
+
+    async def _upload_file(self, f):
         params = self.update_params()
         headers = self.headers.copy()
         headers.pop("Content-Type")
 
-        file_payload = aiohttp.FormData()
-        file_payload.add_field("upload_1024", b, filename=filename, content_type=content_type)
-        resp = await self.session.post(
-            self.UPLOAD,
-            headers=headers,
-            params=params,
-            data=file_payload
-        )
-
-        ret = load_broken_json(await resp.read())
+        await self.ratelimiter.acquire("UPLOAD", Priority.INTERACTIVE)
+        async with self.api_slots.slot(Priority.INTERACTIVE):
+            #file objects and async iterables are streamed by aiohttp in chunks instead of being read up front
+            with f.open() as (body, filename):
+                if filename:
+                    content_type = mimetypes.guess_type(filename)[0]
+                else:
+                    filename = "file"
+                    content_type = None
+                file_payload = aiohttp.FormData()
+                file_payload.add_field("upload_1024", body, filename=filename, content_type=content_type)
+                async with self.session.post(self.UPLOAD, headers=headers, params=params, data=file_payload) as resp:
+                    bytes_ = await resp.read()
+
+        ret = load_broken_json(bytes_)
         return ret["payload"]["metadata"][0]
 
+    def _ensure_edge_probe(self):
+        if self._edge_probe is None or self._edge_probe.done():
+            self._edge_probe = self.loop.create_task(self._probe_edges())
+
+    async def _probe_edges(self):
+        edge = self.edge
+        while edge.has_open():
+            await asyncio.sleep(edge.reset_timeout / 2)
+            for number in edge.due_for_probe():
+                started = self.loop.time()
+                try:
+                    params = {k: v for k, v in self._ping_params().items() if v is not None}
+                    await self.get(self.PING.format(number), params=params, timeout=10, lane="pull", retry=self._edge_retry)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    edge.record_failure(number, hard=True)
+                else:
+                    edge.record_success(number, self.loop.time() - started)
+
+    async def _edge_request(self, url_format, *, params, timeout=None, as_json=False, measure=False, follow=False):
+        #one attempt on the healthiest channel, then a single failover to the next healthiest
+        #with follow, stay on the channel the pull is using instead, so a keep-alive ping keeps that one alive
+        edge = self.edge
+        tried = []
+        while True:
+            if follow:
+                channel = self.pull_channel
+            else:
+                channel = edge.select(exclude=tried)
+                self.pull_channel = channel
+            started = self.loop.time()
+            try:
+                ret = await self.get(url_format.format(channel), params=params, timeout=timeout, lane="pull", as_json=as_json, retry=self._edge_retry)
+            except asyncio.TimeoutError:
+                #a long-poll timing out is normal, only count it against the channel when we measure it
+                if measure:
+                    edge.record_failure(channel, timeout=True)
+                raise
+            except (error.HTTPException, aiohttp.ClientError, ValueError) as e:
+                cause = e if isinstance(e, error.HTTPRequestFailure) else e.__cause__
+                hard = isinstance(cause, error.HTTPRequestFailure) and cause.response.status in (502, 503, 504)
+                edge.record_failure(channel, hard=hard)
+                self._ensure_edge_probe()
+                tried.append(channel)
+                if follow or len(tried) >= 2:
+                    raise
+            else:
+                edge.record_success(channel, self.loop.time() - started if measure else None)
+                return ret
+
     async def fetch_sticky(self):
         params = {
             "msgs_recv": 0,
@@ -611,15 +971,15 @@ class HTTPRequest:
             "clientid": self.client_id
         }
 
-        d = await self.get(self.STICKY.format(self.pull_channel), params=params, as_json=True)
+        d = await self._edge_request(self.STICKY, params=params, as_json=True, measure=True)
 
         lb = d.get("lb_info")
         if lb:
             self.sticky = lb["sticky"]
             self.pool = lb["pool"]
 
-    async def ping(self):
-        params = {
+    def _ping_params(self):
+        return {
             "channel": self.user_channel,
             "clientid": self.client_id,
             "partition": -2,
@@ -630,7 +990,9 @@ class HTTPRequest:
             "sticky_token": self.sticky,
             "sticky_pool": self.pool
         }
-        return await self.get(self.PING.format(self.pull_channel), params=params)
+
+    async def ping(self):
+        return await self._edge_request(self.PING, params=self._ping_params(), measure=True, follow=True)
 
     async def pull(self):
         params = {
@@ -641,7 +1003,7 @@ class HTTPRequest:
             "sticky_pool": self.pool
         }
 
-        d = await self.get(self.STICKY.format(self.pull_channel), params=params, timeout=15, as_json=True)
+        d = await self._edge_request(self.STICKY, params=params, timeout=15, as_json=True)
         self.seq = d.get("seq", "0")
 
         lb = d.get("lb_info")
@@ -651,38 +1013,73 @@ class HTTPRequest:
 
         return d
 
-    async def fetch_image_url(self, image_id):
-        data = await self.get(self.ATTACHMENT_PHOTO, params={"photo_id": image_id}, as_json=True)
+    async def fetch_image_url(self, image_id, *, priority=Priority.BACKGROUND):
+        cached = self.image_urls.get(image_id)
+        if cached is not None:
+            url, expires = cached
+            if expires > time.time():
+                return url
+            del self.image_urls[image_id]
+        return await self._image_flight.do(image_id, self._fetch_image_url, image_id, priority)
+
+    async def fetch_image_urls(self, *image_ids, priority=Priority.BACKGROUND):
+        '''
+        Resolve several image ids at once, in parallel. Return the urls in the same order.
+        '''
+        return await asyncio.gather(*(self.fetch_image_url(image_id, priority=priority) for image_id in image_ids))
+
+    async def _fetch_image_url(self, image_id, priority):
+        data = await self.get(self.ATTACHMENT_PHOTO, params={"photo_id": image_id}, as_json=True, priority=priority)
         url = get_jsmods_require(data, 3)
         if url:
+            #cdn urls are signed, keep them a little less long than the signature lasts
+            expires = utils.url_expiry(url)
+            if expires is None:
+                expires = time.time() + self.image_url_ttl
+            else:
+                expires -= 60
+            self.image_urls[image_id] = (url, expires)
             return url
         else:
             raise error.UnexpectedResponse("Cannot find image url.")
 
-    async def graphql_request(self, *queries):
+    async def graphql_request(self, *queries, priority=Priority.BACKGROUND):
         data = {}
         for i, query in enumerate(queries):
             data["q{}".format(i)] = query.value
         d = {
             "method": "GET",
             "response_format": "json",
-            "queries": json.dumps(data)
+            "queries": utils.to_json(data)
         }
-        batch = await self.post(self.GRAPHQL, data=d, as_json=True, json_decoder=load_concat_json)
+        batch = await self.post(self.GRAPHQL, data=d, as_json=True, json_decoder=load_concat_json, priority=priority)
         return batch
 
-    async def fetch_threads(self, *thread_ids):
-        queries = []
-        for tid in thread_ids:
-            queries.append(GraphQL.fetch_thread_info(tid))
+    async def graphql(self, query):
+        #queries from concurrent callers are coalesced into one graphqlbatch request
+        return await self._graphql_batcher.submit(query)
 
+    async def _graphql_batch(self, queries):
         ret = await self.graphql_request(*queries)
-        return list(ret[0].values())
+        results = [error.UnexpectedResponse("Missing result for query q{}.".format(i)) for i in range(len(queries))]
+        for obj in ret:
+            for key, value in obj.items():
+                if key.startswith("q"):
+                    try:
+                        index = int(key[1:])
+                    except ValueError:
+                        continue
+                    if index < len(results):
+                        results[index] = value
+        return results
+
+    async def fetch_threads(self, *thread_ids):
+        return await asyncio.gather(*(self.graphql(GraphQL.fetch_thread_info(tid)) for tid in thread_ids))
 
-    async def fetch_users(self, *user_ids):
+    async def fetch_users(self, *user_ids, priority=Priority.BACKGROUND):
         queries = {"ids[{}]".format(i): uid for i, uid in enumerate(user_ids)}
 
-        data = await self.post(self.USER_INFO, data=queries, as_json=True)
+        data = await self.post(self.USER_INFO, data=queries, as_json=True, priority=priority)
         return data["payload"]["profiles"]
 
     async def mark_seen(self):
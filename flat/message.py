@@ -1,4 +1,5 @@
-from . import base, content, attachment
+from . import base, content, attachment, utils
+import asyncio
 from datetime import datetime
 
 __all__ = ("Message", "Reaction")
@@ -6,6 +7,8 @@ __all__ = ("Message", "Reaction")
 #==================================================================================================================================================
 
 class Reaction:
+    __slots__ = ("emoji", "author", "message")
+
     def __init__(self, emoji, *, author, message):
         self.emoji = emoji
         self.author = author
@@ -13,7 +16,128 @@ class Reaction:
 
 #==================================================================================================================================================
 
+_MISSING = object()
+
 class Message(base.Object):
+    '''
+    Messages built from a raw delta keep a reference to it and only parse
+    timestamp, text, bigmoji, files, sticker, embed_link and mentions on first access.
+    '''
+    __slots__ = (
+        "author", "thread", "reactions", "_delta", "_timestamp", "_text", "_bigmoji",
+        "_sticker", "_embed_link", "_files", "_mentions"
+    )
+
+    def __init__(
+        self, id, *, _state, author, thread, timestamp=_MISSING, text=_MISSING, bigmoji=_MISSING,
+        sticker=_MISSING, embed_link=_MISSING, files=_MISSING, mentions=_MISSING, reactions=None, _delta=None
+    ):
+        super().__init__(id, _state=_state)
+        self.author = author
+        self.thread = thread
+        self.reactions = [] if reactions is None else reactions
+        self._delta = _delta
+        self._timestamp = timestamp
+        self._text = text
+        self._bigmoji = bigmoji
+        self._sticker = sticker
+        self._embed_link = embed_link
+        self._files = files
+        self._mentions = mentions
+
+    @classmethod
+    def from_delta(cls, state, delta, *, author, thread):
+        return cls(delta["messageMetadata"]["messageId"], _state=state, author=author, thread=thread, _delta=delta)
+
+    @property
+    def timestamp(self):
+        if self._timestamp is _MISSING:
+            self._timestamp = datetime.fromtimestamp(int(self._delta["messageMetadata"]["timestamp"])/1000)
+        return self._timestamp
+
+    @property
+    def text(self):
+        if self._text is _MISSING:
+            self._parse_body()
+        return self._text
+
+    @property
+    def bigmoji(self):
+        if self._bigmoji is _MISSING:
+            self._parse_body()
+        return self._bigmoji
+
+    @property
+    def files(self):
+        if self._files is _MISSING:
+            self._parse_attachments()
+        return self._files
+
+    @property
+    def sticker(self):
+        if self._sticker is _MISSING:
+            self._parse_attachments()
+        return self._sticker
+
+    @property
+    def embed_link(self):
+        if self._embed_link is _MISSING:
+            self._parse_attachments()
+        return self._embed_link
+
+    @property
+    def mentions(self):
+        if self._mentions is _MISSING:
+            self._parse_mentions()
+        return self._mentions
+
+    async def resolve_urls(self):
+        '''
+        Resolve the urls of all attached files at once and return them in attachment order.
+        '''
+        return await asyncio.gather(*(f.get_url() for f in self.files))
+
+    def _parse_body(self):
+        delta = self._delta
+        text = delta.get("body", "")
+        bigmoji = None
+        for tag in delta["messageMetadata"]["tags"]:
+            if tag.startswith("hot_emoji_size:"):
+                bigmoji = content.Bigmoji(emoji=text, size=tag[15:])
+                text = ""
+        self._text = text
+        self._bigmoji = bigmoji
+
+    def _parse_attachments(self):
+        files = []
+        sticker = None
+        embed_link = None
+        for a in self._delta["attachments"] or ():
+            a = self._state._parse_attachment(a)
+            if isinstance(a, attachment.Sticker):
+                sticker = a
+                break
+            elif isinstance(a, attachment.EmbedLink):
+                embed_link = a
+                break
+            else:
+                files.append(a)
+        self._files = files
+        self._sticker = sticker
+        self._embed_link = embed_link
+
+    def _parse_mentions(self):
+        mentions = []
+        try:
+            raw_mentions = utils.from_json(self._delta["data"]["prng"])
+        except (KeyError, TypeError):
+            pass
+        else:
+            thread = self.thread
+            for i in raw_mentions:
+                mentions.append(content.Mention(user=thread.get_participant(i["i"]), offset=i["o"], length=i["l"]))
+        self._mentions = mentions
+
     @classmethod
     def from_content(cls, state, data, ctn):
         if not isinstance(ctn, content.Content):
@@ -25,7 +149,7 @@ class Message(base.Object):
         author = thread.get_participant(state.client_user.id)
         ts = datetime.fromtimestamp(data["timestamp"]/1000)
 
-        bigmoji = ctn.bigmoji
+        bigmoji = ctn._bigmoji
 
         files = []
         sticker = None
@@ -61,7 +185,7 @@ class Message(base.Object):
             text = ctn._text
             mentions = []
             for m in ctn._mentions:
-                mentions.append(ctn.Mention(user=thread.get_participant(m.user.id), offset=m.offset, length=m.length))
+                mentions.append(content.Mention(user=thread.get_participant(m.user.id), offset=m.offset, length=m.length))
             return cls(
                 mid, _state=state, author=author, thread=thread, timestamp=ts,
                 text=text, bigmoji=None, sticker=None, embed_link=embed_link,
@@ -3,9 +3,14 @@ from . import base
 #==================================================================================================================================================
 
 class Participant(base.Object):
-    def __init__(self, **kwargs):
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+    __slots__ = ("user", "thread", "admin", "nickname")
+
+    def __init__(self, *, _state, user, thread, admin=None, nickname=None):
+        super().__init__(user.id, _state=_state)
+        self.user = user
+        self.thread = thread
+        self.admin = admin
+        self.nickname = nickname
 
     @property
     def id(self):
@@ -0,0 +1,84 @@
+from .enums import Priority
+from .scheduler import PrioritySemaphore
+import asyncio
+import time
+
+__all__ = ("TokenBucket", "RateLimiter")
+
+#==================================================================================================================================================
+
+class TokenBucket:
+    '''
+    Token bucket with adaptive rate.
+    Errors halve the current rate (at most once per cooldown), successes slowly bring it back up to the configured rate.
+    Waiting callers are served by priority, then in arrival order.
+    '''
+    def __init__(self, rate, capacity=None, *, min_rate=None, cooldown=1.0):
+        if rate <= 0:
+            raise ValueError("Rate must be positive.")
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.min_rate = min_rate or rate / 16
+        self.cooldown = cooldown
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._last_penalty = 0
+        self._lock = PrioritySemaphore(1)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority=Priority.NORMAL):
+        #waiters of the same priority are woken in FIFO order and lower priorities age up, so no caller starves
+        async with self._lock.slot(priority):
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def penalize(self):
+        now = time.monotonic()
+        if now - self._last_penalty < self.cooldown:
+            return
+        self._refill()
+        self._last_penalty = now
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class RateLimiter:
+    '''
+    Token buckets keyed by endpoint name. Endpoints without a bucket are not limited.
+    limits is a mapping of endpoint -> (rate per second, burst), or None to leave that endpoint unlimited.
+    '''
+    def __init__(self, limits):
+        self._buckets = {}
+        for key, limit in limits.items():
+            if limit is not None:
+                rate, burst = limit
+                self._buckets[key] = TokenBucket(rate, burst)
+
+    def get_bucket(self, key):
+        return self._buckets.get(key)
+
+    async def acquire(self, key, priority=Priority.NORMAL):
+        bucket = self._buckets.get(key)
+        if bucket:
+            await bucket.acquire(priority)
+
+    def penalize(self, key):
+        bucket = self._buckets.get(key)
+        if bucket:
+            bucket.penalize()
+
+    def reward(self, key):
+        bucket = self._buckets.get(key)
+        if bucket:
+            bucket.reward()
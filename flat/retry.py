@@ -0,0 +1,100 @@
+from .enums import RetryAction
+from . import error
+import aiohttp
+import collections
+import random
+
+__all__ = ("RetryPolicy", "RetryBudget", "RetryEvent")
+
+#==================================================================================================================================================
+
+RetryEvent = collections.namedtuple("RetryEvent", "method url attempt delay action exception")
+
+DEFAULT_STATUSES = {
+    429: RetryAction.RETRY,
+    500: RetryAction.RETRY,
+    502: RetryAction.RETRY,
+    503: RetryAction.RETRY,
+    504: RetryAction.RETRY,
+    1357001: RetryAction.RELOGIN,
+    1357004: RetryAction.RELOGIN
+}
+
+#==================================================================================================================================================
+
+class RetryPolicy:
+    '''
+    How a failed request is retried: how many attempts, how long to wait between them
+    (exponential backoff, with full jitter unless disabled) and which failures are worth retrying at all.
+    statuses maps a response status, or the code of an error payload facebook sends with status 200,
+    to a RetryAction and is merged over DEFAULT_STATUSES. Anything not listed there is fatal.
+    '''
+    def __init__(self, *, max_attempts=3, base_delay=0.5, max_delay=30, jitter=True, statuses=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.statuses = DEFAULT_STATUSES.copy()
+        if statuses:
+            self.statuses.update(statuses)
+
+    def replace(self, **kwargs):
+        '''
+        Return a copy of this policy with some fields overridden, for per-call use.
+        '''
+        new = RetryPolicy(
+            max_attempts=self.max_attempts, base_delay=self.base_delay, max_delay=self.max_delay,
+            jitter=self.jitter, statuses=self.statuses
+        )
+        statuses = kwargs.pop("statuses", None)
+        if statuses:
+            new.statuses.update(statuses)
+        for key, value in kwargs.items():
+            if not hasattr(new, key):
+                raise TypeError("Unknown retry policy field: {}".format(key))
+            setattr(new, key, value)
+        return new
+
+    def classify(self, exc, *, idempotent=True):
+        if isinstance(exc, error.ErrorResponse):
+            return self.statuses.get(exc.code, RetryAction.FATAL)
+        elif isinstance(exc, error.HTTPRequestFailure):
+            return self.statuses.get(exc.response.status, RetryAction.FATAL)
+        elif isinstance(exc, aiohttp.ClientConnectorError):
+            #never reached the server, always safe to try again
+            return RetryAction.RETRY
+        elif isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, ValueError)):
+            #dropped connection, truncated or garbled body: the request may already have been handled,
+            #so only repeat it when doing so twice is harmless
+            return RetryAction.RETRY if idempotent else RetryAction.FATAL
+        else:
+            return RetryAction.FATAL
+
+    def get_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            return random.uniform(0, delay)
+        else:
+            return delay
+
+#==================================================================================================================================================
+
+class RetryBudget:
+    '''
+    Caps retries across all requests, so an outage doesn't multiply load.
+    Every request deposits ratio into the budget (up to max_balance) and every retry withdraws one.
+    '''
+    def __init__(self, ratio=0.2, *, max_balance=10):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self.balance = max_balance
+
+    def deposit(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self):
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        else:
+            return False
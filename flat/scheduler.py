@@ -0,0 +1,269 @@
+from .enums import OverflowPolicy, Priority
+import asyncio
+import collections
+import itertools
+import logging
+
+__all__ = ("ShardedScheduler", "KeyedScheduler", "PrioritySemaphore")
+
+log = logging.getLogger(__name__)
+
+#==================================================================================================================================================
+
+class ShardedScheduler:
+    '''
+    Run items through a fixed number of workers, each with its own bounded queue.
+    Items sharing a key always land on the same worker, so they are handled in submission order,
+    while items with different keys can be handled in parallel.
+    '''
+    def __init__(self, handler, *, workers=4, max_queue=1000, overflow=OverflowPolicy.BLOCK, loop=None):
+        if workers < 1:
+            raise ValueError("Need at least one worker.")
+        self.loop = loop or asyncio.get_event_loop()
+        self.handler = handler
+        self.overflow = OverflowPolicy(overflow)
+        self.dropped = 0
+        self._queues = [asyncio.Queue(maxsize=max_queue) for i in range(workers)]
+        self._tasks = []
+        self._closed = False
+
+    @property
+    def workers(self):
+        return len(self._queues)
+
+    def start(self):
+        if not self._tasks and not self._closed:
+            self._tasks = [self.loop.create_task(self._work(q)) for q in self._queues]
+
+    async def close(self):
+        '''
+        Stop the workers and drop everything still queued. Submitting afterwards drops the item and returns False.
+        '''
+        self._closed = True
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        #emptying the queues also wakes submitters blocked on a full one
+        for q in self._queues:
+            self._drain(q)
+
+    def _drain(self, queue):
+        while not queue.empty():
+            queue.get_nowait()
+            queue.task_done()
+
+    def shard(self, key):
+        return self._queues[hash(key) % len(self._queues)]
+
+    async def submit(self, key, item):
+        if self._closed:
+            return False
+        self.start()
+        queue = self.shard(key)
+        if not queue.full():
+            queue.put_nowait(item)
+            return True
+
+        policy = self.overflow
+        if policy is OverflowPolicy.BLOCK:
+            await queue.put(item)
+            if self._closed:
+                #closed while we waited for room, nobody will handle it
+                self._drain(queue)
+                return False
+            return True
+        elif policy is OverflowPolicy.DROP_NEWEST:
+            self.dropped += 1
+            log.warning("Queue for key %s is full, dropping newest item.", key)
+            return False
+        else:
+            queue.get_nowait()
+            queue.task_done()
+            queue.put_nowait(item)
+            self.dropped += 1
+            log.warning("Queue for key %s is full, dropping oldest item.", key)
+            return True
+
+    def qsize(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def depths(self):
+        return [q.qsize() for q in self._queues]
+
+    async def join(self):
+        for q in self._queues:
+            await q.join()
+
+    async def _work(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Ignoring exception in scheduled handler.")
+            finally:
+                queue.task_done()
+
+#==================================================================================================================================================
+
+class KeyedScheduler:
+    '''
+    Handle items in submission order per key, with at most concurrency items being handled at once overall.
+    Unlike ShardedScheduler, a slow key only holds up its own items, never those of other keys.
+    Each key's queue holds up to max_queue items, submitting waits while it is full.
+    Items still queued on close are passed to on_discard.
+    '''
+    def __init__(self, handler, *, concurrency=8, max_queue=100, on_discard=None, loop=None):
+        if concurrency < 1:
+            raise ValueError("Need a concurrency of at least one.")
+        self.loop = loop or asyncio.get_event_loop()
+        self.handler = handler
+        self.max_queue = max_queue
+        self.on_discard = on_discard
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._tasks = {}
+        #submitters waiting for room in a key's queue, so the queue isn't dropped from under them
+        self._putting = collections.Counter()
+        self._closed = False
+
+    async def submit(self, key, item):
+        if self._closed:
+            self._discard(item)
+            return False
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(maxsize=self.max_queue)
+        self._putting[key] += 1
+        try:
+            await queue.put(item)
+        finally:
+            self._putting[key] -= 1
+            if not self._putting[key]:
+                del self._putting[key]
+
+        if self._closed:
+            self._drain(queue)
+        elif key not in self._tasks:
+            self._tasks[key] = self.loop.create_task(self._work(key, queue))
+        return True
+
+    def qsize(self):
+        return sum(q.qsize() for q in self._queues.values())
+
+    def depths(self):
+        return {key: q.qsize() for key, q in self._queues.items()}
+
+    async def close(self):
+        self._closed = True
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for queue in self._queues.values():
+            self._drain(queue)
+
+    def _discard(self, item):
+        if self.on_discard:
+            self.on_discard(item)
+
+    def _drain(self, queue):
+        while not queue.empty():
+            self._discard(queue.get_nowait())
+
+    async def _work(self, key, queue):
+        try:
+            while not queue.empty():
+                item = queue.get_nowait()
+                try:
+                    async with self._slots:
+                        await self.handler(item)
+                except asyncio.CancelledError:
+                    self._discard(item)
+                    raise
+                except Exception:
+                    log.exception("Ignoring exception in scheduled handler.")
+        finally:
+            #there is only ever one worker per key, so the entry is this one (or already gone on close)
+            self._tasks.pop(key, None)
+            #keep the queue while someone is about to put into it, they will start a new worker
+            if queue.empty() and not self._putting[key] and self._queues.get(key) is queue:
+                del self._queues[key]
+
+#==================================================================================================================================================
+
+class _Slot:
+    def __init__(self, semaphore, priority):
+        self.semaphore = semaphore
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.semaphore.acquire(self.priority)
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+class PrioritySemaphore:
+    '''
+    Semaphore that wakes waiters by priority, then by arrival order.
+    Every aging seconds spent waiting moves a waiter up one priority class,
+    so background work is delayed by interactive work but never starved.
+    '''
+    def __init__(self, value, *, aging=5.0, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.aging = aging
+        self._value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def locked(self):
+        return self._value <= 0
+
+    def waiting(self):
+        return len(self._waiters)
+
+    def slot(self, priority=Priority.NORMAL):
+        return _Slot(self, priority)
+
+    async def acquire(self, priority=Priority.NORMAL):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+
+        fut = self.loop.create_future()
+        waiter = (int(priority), next(self._counter), self.loop.time(), fut)
+        self._waiters.append(waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif fut.done() and not fut.cancelled():
+                #we were handed the slot right as we got cancelled, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        self._value += 1
+        self._wake()
+
+    def _effective_priority(self, waiter, now):
+        priority, order, since, fut = waiter
+        return (priority - (now - since) // self.aging, order)
+
+    def _wake(self):
+        waiters = self._waiters
+        while self._value > 0 and waiters:
+            now = self.loop.time()
+            waiter = min(waiters, key=lambda w: self._effective_priority(w, now))
+            waiters.remove(waiter)
+            fut = waiter[3]
+            if not fut.done():
+                self._value -= 1
+                fut.set_result(None)
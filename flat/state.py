@@ -6,13 +6,18 @@ from .message import *
 from .attachment import *
 from .error import *
 from .enums import *
+from .scheduler import ShardedScheduler, KeyedScheduler
+from .cache import MessageCache, LRUCache, SingleFlight
+from .batch import Batcher
+from .store import Store
 from . import utils
-import collections
-import json
 import traceback
 import asyncio
 from datetime import datetime
 import copy
+import logging
+
+log = logging.getLogger(__name__)
 
 #==================================================================================================================================================
 
@@ -23,6 +28,31 @@ def extract_thread_id(node):
     except KeyError:
         return key["otherUserFbId"]
 
+def client_payload(delta):
+    return utils.from_json(bytes(delta["payload"]))
+
+def shard_key(raw_message):
+    '''
+    Return (key, payload): the thread id the event belongs to, or None,
+    and the decoded payload of a ClientPayload delta, so it is only decoded once.
+    '''
+    if raw_message.get("type") != "delta":
+        return None, None
+    delta = raw_message["delta"]
+    payload = None
+    try:
+        if delta.get("class") == "ClientPayload":
+            #reactions must go to the same worker as the message they react to
+            payload = client_payload(delta)
+            for d in payload["deltas"]:
+                for node in d.values():
+                    if isinstance(node, dict) and "threadKey" in node:
+                        return extract_thread_id(node), payload
+            return None, payload
+        return extract_thread_id(delta.get("messageMetadata", delta)), None
+    except (KeyError, TypeError, ValueError):
+        return None, payload
+
 def may_has_extension(filename):
     if filename.partition(".")[1]:
         return filename
@@ -33,15 +63,55 @@ def may_has_extension(filename):
 #==================================================================================================================================================
 
 class State:
-    def __init__(self, *, loop, http, dispatch, max_messages):
+    def __init__(self, *, loop, http, dispatch, max_messages, **options):
+        self.loop = loop
         self.dispatch = dispatch
         self.http = http
         self.max_messages = max_messages
+        self.lru_messages = options.get("lru_messages", False)
+        self.max_users = options.get("max_users")
+        self.max_threads = options.get("max_threads")
+        self.user_expiry = options.get("user_expiry")
+        self.thread_expiry = options.get("thread_expiry")
+        self.pinned_threads = options.get("pinned_threads", ())
         self.client_user = None
         self.clear()
-        self.user_lock = asyncio.Lock()
-        self.thread_lock = asyncio.Lock()
+        cache_path = options.get("cache_path")
+        self.store = Store(cache_path, loop=loop) if cache_path else None
+        self.user_cache_ttl = options.get("user_cache_ttl", 86400)
+        self.thread_cache_ttl = options.get("thread_cache_ttl", 3600)
+        #uploaded attachment ids go in the same store, so they survive restarts too
+        http.upload_store = self.store
+        #sticker id -> sprite sheet / rendered gif bytes, optionally mirrored to files in sticker_cache_dir
+        self.sticker_sprites = LRUCache(options.get("sticker_cache_size", 128))
+        self.sticker_gifs = LRUCache(options.get("sticker_cache_size", 128))
+        self.sticker_cache_dir = options.get("sticker_cache_dir")
+        self.sticker_executor = options.get("sticker_executor")
+        self._sticker_flight = SingleFlight(loop=loop)
+        self._user_flight = SingleFlight(loop=loop)
+        self._thread_flight = SingleFlight(loop=loop)
+        self._user_batcher = Batcher(
+            self._fetch_user_batch,
+            max_size=options.get("user_batch_size", 50),
+            delay=options.get("user_batch_delay", 0.01),
+            loop=loop
+        )
         self._job_queue = asyncio.Queue()
+        self._events = ShardedScheduler(
+            self._process_item,
+            workers=options.get("event_workers", 4),
+            max_queue=options.get("event_queue_size", 1000),
+            overflow=options.get("event_overflow", OverflowPolicy.BLOCK),
+            loop=loop
+        )
+        #sends to one thread go out in order, up to send_workers threads at once
+        self._sends = KeyedScheduler(
+            self._run_send,
+            concurrency=options.get("send_workers", 8),
+            max_queue=options.get("send_queue_size", 100),
+            on_discard=self._discard_send,
+            loop=loop
+        )
 
         self.process = {
             ("delta", "ParticipantsAddedToGroupThread", None):          self.process_participants_add,
@@ -66,9 +136,12 @@ class State:
         }
 
     def clear(self):
-        self.threads = {}
-        self.users = {}
-        self.messages = collections.deque(maxlen=self.max_messages)
+        #evicted entries are simply fetched again on the next cache miss
+        self.threads = LRUCache(self.max_threads, ttl=self.thread_expiry)
+        self.users = LRUCache(self.max_users, ttl=self.user_expiry)
+        for thread_id in self.pinned_threads:
+            self.threads.pin(thread_id)
+        self.messages = MessageCache(self.max_messages, lru=self.lru_messages)
 
     def _parse_user(self, data):
         utype = data["type"]
@@ -81,16 +154,57 @@ class State:
             raise UnexpectedResponse("Unknown user type: {}".format(ttype))
 
     async def fetch_user(self, user_id):
-        async with self.user_lock:
-            try:
-                return self.users[user_id]
-            except KeyError:
-                pass
-            raw = await self.http.fetch_users(user_id)
-            data = raw[user_id]
+        try:
+            return self.users[user_id]
+        except KeyError:
+            pass
+        users = await self._user_flight.do_many((user_id,), self._fetch_users)
+        return users[user_id]
+
+    async def _fetch_users(self, user_ids):
+        users = self.users
+        ret = {}
+        if self.store:
+            stale = []
+            cached = await self.store.get_many("user", user_ids)
+            for user_id, (data, expired) in cached.items():
+                u = self._parse_user(data)
+                users[user_id] = u
+                ret[user_id] = u
+                if expired:
+                    stale.append(user_id)
+            if stale:
+                self._revalidate(self._request_users(stale))
+            user_ids = [uid for uid in user_ids if uid not in ret]
+
+        if user_ids:
+            ret.update(await self._request_users(user_ids))
+        return ret
+
+    async def _request_users(self, user_ids):
+        batch_data = await asyncio.gather(*(self._user_batcher.submit(uid) for uid in user_ids))
+        users = self.users
+        ret = {}
+        for user_id, data in zip(user_ids, batch_data):
             u = self._parse_user(data)
-            self.users[user_id] = u
-            return u
+            users[user_id] = u
+            ret[user_id] = u
+        if self.store:
+            await self.store.put_many("user", zip(user_ids, batch_data), ttl=self.user_cache_ttl)
+        return ret
+
+    def _revalidate(self, coro):
+        async def wrapped():
+            try:
+                await coro
+            except Exception:
+                log.warning("Background revalidation failed.", exc_info=True)
+        return self.loop.create_task(wrapped())
+
+    async def _fetch_user_batch(self, user_ids):
+        #lookups from concurrent callers end up here together and cost a single user_info request
+        batch_data = await self.http.fetch_users(*user_ids)
+        return [batch_data.get(uid, KeyError(uid)) for uid in user_ids]
 
     async def fetch_client_user(self):
         client_user_id = self.http.user_id
@@ -98,23 +212,45 @@ class State:
         data = raw[client_user_id]
         u = ClientUser.from_data(self, data)
         self.client_user = u
+        self.users.pin(client_user_id)
         self.users[client_user_id] = u
         return u
 
     async def bulk_fetch_users(self, user_ids):
-        async with self.user_lock:
-            need_to_fetch = [uid for uid in user_ids if uid not in self.users]
-            if need_to_fetch:
-                batch_data = await self.http.fetch_users(*need_to_fetch)
-                users = self.users
-                for user_id, data in batch_data.items():
-                    u = self._parse_user(data)
-                    users[user_id] = u
-            return {uid: users[uid] for uid in user_ids}
+        user_ids = list(user_ids)
+        users = self.users
+        ret = {}
+        need_to_fetch = []
+        for uid in user_ids:
+            try:
+                ret[uid] = users[uid]
+            except KeyError:
+                need_to_fetch.append(uid)
+        if need_to_fetch:
+            ret.update(await self._user_flight.do_many(need_to_fetch, self._fetch_users))
+        return {uid: ret[uid] for uid in user_ids}
 
     async def _fetch_thread_info(self, thread_id):
+        if self.store:
+            cached = await self.store.get("thread", thread_id)
+            if cached:
+                data, expired = cached
+                if expired:
+                    self._revalidate(self._refresh_thread(thread_id))
+                return await self._parse_thread(data)
+        return await self._request_thread(thread_id)
+
+    async def _request_thread(self, thread_id):
         raw = await self.http.fetch_threads(thread_id)
         data = raw[0]["data"]["message_thread"]
+        if self.store:
+            await self.store.put("thread", thread_id, data, ttl=self.thread_cache_ttl)
+        return await self._parse_thread(data)
+
+    async def _refresh_thread(self, thread_id):
+        self.threads[thread_id] = await self._request_thread(thread_id)
+
+    async def _parse_thread(self, data):
         ttype = data["thread_type"]
         client_user = self.client_user
 
@@ -149,33 +285,95 @@ class State:
             raise UnexpectedResponse("Unknown thread type: {}".format(ttype))
 
     async def fetch_thread(self, thread_id):
-        async with self.thread_lock:
-            try:
-                return self.threads[thread_id]
-            except KeyError:
-                pass
-            thread = await self._fetch_thread_info(thread_id)
-            self.threads[thread_id] = thread
-            return thread
+        try:
+            return self.threads[thread_id]
+        except KeyError:
+            pass
+        return await self._thread_flight.do(thread_id, self._fetch_and_store_thread, thread_id)
+
+    async def _fetch_and_store_thread(self, thread_id):
+        thread = await self._fetch_thread_info(thread_id)
+        self.threads[thread_id] = thread
+        return thread
 
     async def process_raw_data(self, raw_data):
         self.dispatch("raw_pull_data", raw_data)
         if "ms" not in raw_data:
             return
         for m in raw_data["ms"]:
-            self.dispatch("raw_event", m)
-            message_type = m.get("type")
-            if message_type == "delta":
-                delta = m["delta"]
-                key = (message_type, delta.get("class"), delta.get("type"))
-            else:
-                key = message_type
+            key, payload = shard_key(m)
+            await self._events.submit(key, (m, payload))
+
+    async def _process_item(self, item):
+        m, payload = item
+        await self.process_event(m, payload)
+
+    async def process_event(self, m, payload=None):
+        self.dispatch("raw_event", m)
+        message_type = m.get("type")
+        if message_type == "delta":
+            delta = m["delta"]
+            key = (message_type, delta.get("class"), delta.get("type"))
+        else:
+            key = message_type
 
-            proc = self.process.get(key, self.process_unknown_message)
-            try:
+        proc = self.process.get(key, self.process_unknown_message)
+        try:
+            if proc == self.process_payload:
+                await proc(m, payload)
+            else:
                 await proc(m)
-            except:
-                traceback.print_exc()
+        except:
+            traceback.print_exc()
+
+    def pin_thread(self, thread_id):
+        self.threads.pin(thread_id)
+
+    def unpin_thread(self, thread_id):
+        self.threads.unpin(thread_id)
+
+    def event_queue_depths(self):
+        return self._events.depths()
+
+    def send_queue_depths(self):
+        '''
+        Return a thread id -> number of queued sends mapping.
+        '''
+        return self._sends.depths()
+
+    async def queue_send(self, dest, content):
+        fut = self.loop.create_future()
+        await self._sends.submit(dest.id, (dest, content, fut))
+        return fut
+
+    def _discard_send(self, item):
+        dest, content, fut = item
+        if not fut.done():
+            fut.set_exception(SendFailure("Client closed before the message was sent."))
+
+    async def _run_send(self, item):
+        dest, content, fut = item
+        if fut.cancelled():
+            return
+        try:
+            raw_messages = await self.http.send_message(dest, content)
+            messages = [await self.parse_send_message(rm, content) for rm in raw_messages]
+        except asyncio.CancelledError:
+            if not fut.done():
+                fut.set_exception(SendFailure("Client closed before the message was sent."))
+            raise
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(messages)
+
+    async def close(self):
+        await self._events.close()
+        await self._sends.close()
+        if self.store:
+            self.store.close()
 
     async def get_message_info(self, metadata):
         message_id = metadata["messageId"]
@@ -195,7 +393,7 @@ class State:
 
         added_ids = (x["userFbId"] for x in delta["addedParticipants"])
         users = await self.bulk_fetch_users(added_ids)
-        added_participants = [thread.store_participant(u) for u in users]
+        added_participants = [thread.store_participant(u) for u in users.values()]
 
         self.dispatch("participants_added", author, thread, added_participants)
 
@@ -208,7 +406,7 @@ class State:
         user = thread.get_participant(left_id)
 
         if user == self.client_user:
-            self.threads.pop(thread_id)
+            self.threads.pop(thread.id, None)
         left_participant = thread._participants.pop(left_id)
 
         self.dispatch("participants_leave", author, thread, left_participant)
@@ -219,7 +417,7 @@ class State:
         message_id, author, thread, timestamp = await self.get_message_info(metadata)
 
         new_color = int(delta["untypedData"]["theme_color"][2:], 16)
-        old_color, thread._color = thread._color, new_color
+        old_color, thread.color = thread.color, new_color
 
         self.dispatch("thread_color_change", author, thread, old_color, new_color)
 
@@ -229,7 +427,7 @@ class State:
         message_id, author, thread, timestamp = await self.get_message_info(metadata)
 
         new_emoji = delta["untypedData"]["thread_icon"]
-        old_emoji, thread._emoji = thread._emoji, new_emoji
+        old_emoji, thread.emoji = thread.emoji, new_emoji
 
         self.dispatch("thread_emoji_change", author, thread, old_emoji, new_emoji)
 
@@ -283,7 +481,7 @@ class State:
         '''
         Update pic and admins
         '''
-        raw = await self.http.fetch_thread_info(thread.id)
+        raw = await self.http.fetch_threads(thread.id)
         data = raw[0]["data"]["message_thread"]
         if isinstance(thread, Group):
             before = copy.copy(thread)
@@ -307,11 +505,7 @@ class State:
             self.dispatch("force_thread_update", before, after)
 
     def get_message(self, message_id):
-        for m in self.messages:
-            if m.id == message_id:
-                return m
-        else:
-            return None
+        return self.messages.get(message_id)
 
     async def process_message_delivered(self, raw_message):
         delta = raw_message["delta"]
@@ -325,19 +519,19 @@ class State:
         thread = await self.fetch_thread(thread_id)
         self.dispatch("message_seen", thread)
 
-    async def process_payload(self, raw_message):
+    async def process_payload(self, raw_message, payload=None):
         delta = raw_message["delta"]
-        payload = json.loads(bytes(delta["payload"]))
+        if payload is None:
+            payload = client_payload(delta)
         deltas = payload["deltas"]
         self.dispatch("raw_reaction_add", deltas)
         for d in deltas:
             if "deltaMessageReaction" in d:
                 node = d["deltaMessageReaction"]
-                sender_id = node["senderId"]
-                m = utils.get(self.messages, lambda m: m.id==sender_id)
+                m = self.messages.get(node["messageId"])
                 if m:
                     author = m.thread.get_participant(node["userId"])
-                    self.dispatch("reaction_add", Reaction(node["reaction"], author=author, message=message))
+                    self.dispatch("reaction_add", Reaction(node["reaction"], author=author, message=m))
             elif "unseenNotifCount" in d:
                 self.dispatch("unseen_notification_count", d["unseenNotifCount"])
             elif "deltaThreadConnectivityStatusUpdate" in d:
@@ -349,44 +543,11 @@ class State:
         self.dispatch("raw_message", raw_message)
         delta = raw_message["delta"]
         metadata = delta["messageMetadata"]
-        mid, author, thread, ts = await self.get_message_info(metadata)
-
-        text = delta.get("body", "")
-        bigmoji = None
-        for tag in metadata["tags"]:
-            if tag.startswith("hot_emoji_size:"):
-                bigmoji = Bigmoji(emoji=text, size=tag[15:])
-                text = ""
-
-        files = []
-        sticker = None
-        embed_link = None
-        if delta["attachments"]:
-            for a in delta["attachments"]:
-                a = self._parse_attachment(a)
-                if isinstance(a, Sticker):
-                    sticker = a
-                    break
-                elif isinstance(a, EmbedLink):
-                    embed_link = a
-                    break
-                else:
-                    files.append(a)
-
-        mentions = []
-        try:
-            raw_mentions = json.loads(delta["data"]["prng"])
-        except KeyError:
-            pass
-        else:
-            for i in raw_mentions:
-                mentions.append(Mention(user=thread.get_participant(i["i"]), offset=i["o"], length=i["l"]))
+        thread = await self.fetch_thread(extract_thread_id(metadata))
+        author = thread.get_participant(metadata["actorFbId"])
 
-        m = Message(
-            mid, state=self, author=author, thread=thread, timestamp=ts,
-            text=text, bigmoji=bigmoji, sticker=sticker, embed_link=embed_link,
-            files=files, mentions=mentions, reactions=[]
-        )
+        #everything else is parsed from the delta only when a handler asks for it
+        m = Message.from_delta(self, delta, author=author, thread=thread)
         self.messages.append(m)
         self.dispatch("message", m)
 
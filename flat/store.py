@@ -0,0 +1,80 @@
+from . import utils
+import asyncio
+import sqlite3
+import threading
+import time
+
+__all__ = ("Store",)
+
+#==================================================================================================================================================
+
+class Store:
+    '''
+    SQLite-backed cache of raw payloads, so a restarted client can rebuild users and threads without network lookups.
+    Entries are kept past their ttl and reported as expired, so callers can use them and revalidate in the background.
+    Database access runs in an executor to keep the event loop free.
+    '''
+    def __init__(self, path, *, ttl=86400, loop=None, executor=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.path = path
+        self.ttl = ttl
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+
+    def _run(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def _get_many(self, kind, keys):
+        now = time.time()
+        ret = {}
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute("SELECT data, expires FROM entries WHERE kind=? AND key=?", (kind, str(key))).fetchone()
+                if row:
+                    ret[key] = (utils.from_json(row[0]), row[1] <= now)
+        return ret
+
+    def _put_many(self, kind, items, ttl):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        rows = [(kind, str(key), utils.to_json(data), expires) for key, data in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO entries (kind, key, data, expires) VALUES (?, ?, ?, ?)", rows)
+
+    def _delete(self, kind, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE kind=? AND key=?", (kind, str(key)))
+
+    async def get(self, kind, key):
+        '''
+        Return (data, expired), or None if there is no entry.
+        '''
+        ret = await self._run(self._get_many, kind, (key,))
+        return ret.get(key)
+
+    async def get_many(self, kind, keys):
+        '''
+        Return a key -> (data, expired) mapping of the keys that have an entry.
+        '''
+        return await self._run(self._get_many, kind, list(keys))
+
+    async def put(self, kind, key, data, *, ttl=None):
+        await self._run(self._put_many, kind, ((key, data),), ttl)
+
+    async def put_many(self, kind, items, *, ttl=None):
+        items = list(items)
+        if items:
+            await self._run(self._put_many, kind, items, ttl)
+
+    async def delete(self, kind, key):
+        await self._run(self._delete, kind, key)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
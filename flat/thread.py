@@ -18,6 +18,14 @@ def _get_emoji_and_color(data):
 #==================================================================================================================================================
 
 class _BaseThread(base.Object):
+    __slots__ = ("emoji", "color", "_me")
+
+    def __init__(self, id, *, _state, emoji=None, color=None):
+        super().__init__(id, _state=_state)
+        self.emoji = emoji
+        self.color = color
+        self._me = None
+
     @property
     def me(self):
         return self._me
@@ -28,6 +36,12 @@ class _BaseThread(base.Object):
 #==================================================================================================================================================
 
 class OneToOne(_BaseThread, base.OneToOneMixin):
+    __slots__ = ("_recipient",)
+
+    def __init__(self, id, *, _state, emoji=None, color=None):
+        super().__init__(id, _state=_state, emoji=emoji, color=color)
+        self._recipient = None
+
     @classmethod
     def from_data(cls, state, data):
         thread_id = data["thread_key"]["other_user_id"]
@@ -58,6 +72,15 @@ class OneToOne(_BaseThread, base.OneToOneMixin):
         return self._me if pid==self._me.id else self._recipient if pid==self._recipient.id else None
 
 class Group(_BaseThread, base.GroupMixin):
+    __slots__ = ("name", "image_url", "approval_mode", "_participants")
+
+    def __init__(self, id, *, _state, name=None, image_url=None, emoji=None, color=None, approval_mode=None):
+        super().__init__(id, _state=_state, emoji=emoji, color=color)
+        self.name = name
+        self.image_url = image_url
+        self.approval_mode = approval_mode
+        self._participants = {}
+
     @classmethod
     def from_data(cls, state, data):
         thread_id = data["thread_key"]["thread_fbid"]
@@ -70,16 +93,16 @@ class Group(_BaseThread, base.GroupMixin):
         return cls(
             thread_id,
             _state=state,
+            name=data.get("name"),
             image_url=image_url,
             emoji=emoji,
             color=color,
-            approval_mode=data["approval_mode"],
-            _participants={}
+            approval_mode=data["approval_mode"]
         )
 
     @property
     def participants(self):
-        return list(self._participants.value())
+        return list(self._participants.values())
 
     def store_participant(self, user, *, admin=False, nickname=None):
         p = participant.Participant(_state=self._state, user=user, thread=self, admin=admin, nickname=nickname)
@@ -3,14 +3,26 @@ from . import base, enums
 #==================================================================================================================================================
 
 class _BaseUser(base.Object):
-    pass
+    __slots__ = ()
 
 class UnavailableUser(_BaseUser):
-    pass
+    __slots__ = ()
 
 FACEBOOK_USER = UnavailableUser("0")
 
 class User(_BaseUser, base.OneToOneMixin):
+    __slots__ = ("full_name", "first_name", "gender", "alias", "thumbnail", "url", "is_friend")
+
+    def __init__(self, id, *, _state, full_name, first_name, gender, alias, thumbnail, url, is_friend):
+        super().__init__(id, _state=_state)
+        self.full_name = full_name
+        self.first_name = first_name
+        self.gender = gender
+        self.alias = alias
+        self.thumbnail = thumbnail
+        self.url = url
+        self.is_friend = is_friend
+
     @classmethod
     def from_data(cls, state, data):
         if data["id"] == 0:
@@ -29,6 +41,15 @@ class User(_BaseUser, base.OneToOneMixin):
             )
 
 class Page(_BaseUser, base.OneToOneMixin):
+    __slots__ = ("name", "category", "thumbnail", "url")
+
+    def __init__(self, id, *, _state, name, category, thumbnail, url):
+        super().__init__(id, _state=_state)
+        self.name = name
+        self.category = category
+        self.thumbnail = thumbnail
+        self.url = url
+
     @classmethod
     def from_data(cls, state, data):
         if data["id"] == 0:
@@ -44,10 +65,10 @@ class Page(_BaseUser, base.OneToOneMixin):
             )
 
 class _ClientPrivilege:
-    pass
+    __slots__ = ()
 
 class ClientUser(User, _ClientPrivilege):
-    pass
+    __slots__ = ()
 
 class ClientPage(Page, _ClientPrivilege):
-    pass
+    __slots__ = ()
@@ -1,3 +1,11 @@
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 #==================================================================================================================================================
 
@@ -33,3 +41,61 @@ def get_either(container, *keys, default=None):
             continue
     else:
         return default
+
+#==================================================================================================================================================
+
+if orjson is not None:
+    def _default_loads(s):
+        return orjson.loads(s)
+
+    def _default_dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    _default_buffers = True
+else:
+    _default_loads = json.loads
+    _default_dumps = json.dumps
+    _default_buffers = False
+
+_loads = _default_loads
+_dumps = _default_dumps
+_loads_buffers = _default_buffers
+
+def set_json_backend(loads=None, dumps=None, *, buffers=False):
+    '''
+    Replace the functions used for every JSON decode/encode.
+    Set buffers to True if loads accepts memoryview objects directly.
+    Passing None restores the default, which is orjson when installed and the stdlib json module otherwise.
+    '''
+    global _loads, _dumps, _loads_buffers
+    if loads is None:
+        _loads = _default_loads
+        _loads_buffers = _default_buffers
+    else:
+        _loads = loads
+        _loads_buffers = buffers
+    _dumps = dumps or _default_dumps
+
+def from_json(s):
+    if isinstance(s, memoryview) and not _loads_buffers:
+        #decode straight from the buffer instead of copying it into bytes first
+        s = str(s, "utf-8")
+    return _loads(s)
+
+def to_json(obj):
+    return _dumps(obj)
+
+#==================================================================================================================================================
+
+def url_expiry(url):
+    '''
+    Unix timestamp at which a signed CDN url stops working, taken from its oe parameter (hex), or None if it has none.
+    '''
+    try:
+        return int(parse_qs(urlsplit(url).query)["oe"][0], 16)
+    except (KeyError, ValueError):
+        return None
+
+def url_expired(url, *, margin=60):
+    expires = url_expiry(url)
+    return expires is not None and expires - margin <= time.time()
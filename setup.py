@@ -21,7 +21,13 @@ setuptools.setup(
     extras_require={
         "pillow": [
             "pillow"
+        ],
+        "orjson": [
+            "orjson"
+        ],
+        "numpy": [
+            "numpy"
         ]
     },
-    python_requires=">=3.5.3"
+    python_requires=">=3.6"
 )
\ No newline at end of file